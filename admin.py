@@ -2,9 +2,37 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from .models import EmployeeSalary, User, ManagerProfile, EmployeeCategory, EmployeeProfile, SubManagerProfile, CustomerProfile, WorkDay
+from .pagination import EstimatedCountPaginator
+from .search import search_profiles
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for big tables: estimated page counts,
+    no full COUNT(*) next to search results and ordering by primary key.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+
+
+class ProfileSearchAdminMixin:
+    """
+    Searches profiles through the indexed search_text column.
+    """
+    search_fields = ('search_text',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        matches = search_profiles(self.model, None, search_term).values('pk')
+        return queryset.filter(pk__in=matches), False
+
 
 @admin.register(User)
 class UserAdmin(UserAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
         (('Personal info'), {
@@ -17,31 +45,48 @@ class UserAdmin(UserAdmin):
     )
 
 @admin.register(ManagerProfile)
-class ManagerProfileAdmin(admin.ModelAdmin):
+class ManagerProfileAdmin(LargeTableAdmin):
     list_display = ('user','speciality',)
-    ordering = ('user',)
-    search_fields = ('user', 'speciality',)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    search_fields = ('user__username', 'speciality',)
 
 @admin.register(EmployeeProfile)
-class EmployeeProfileAdmin(admin.ModelAdmin):
+class EmployeeProfileAdmin(ProfileSearchAdminMixin, LargeTableAdmin):
     list_display = ('user','category',)
-    ordering = ('user',)
-    search_fields = ('user', 'category',)
+    list_select_related = ('user', 'category',)
+    autocomplete_fields = ('user', 'category',)
+    raw_id_fields = ('company',)
 
 @admin.register(EmployeeCategory)
 class EmployeeCategoryAdmin(admin.ModelAdmin):
     list_display = ('name','slug',)
     ordering = ('name',)
     search_fields = ('name', 'slug',)
+    raw_id_fields = ('company',)
 
 
 @admin.register(SubManagerProfile)
-class SubManagerProfileAdmin(admin.ModelAdmin):
+class SubManagerProfileAdmin(LargeTableAdmin):
     list_display = ('user',)
-    ordering = ('user',)
-    search_fields = ('user',)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    search_fields = ('user__username',)
+
+
+@admin.register(CustomerProfile)
+class CustomerProfileAdmin(ProfileSearchAdminMixin, LargeTableAdmin):
+    list_display = ('user', 'company', 'address',)
+    list_select_related = ('user', 'company',)
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('creator', 'company',)
+
+
+@admin.register(EmployeeSalary)
+class EmployeeSalaryAdmin(LargeTableAdmin):
+    list_display = ('employee', 'type', 'salary', 'percentage_of_income',)
+    list_select_related = ('employee__user',)
+    raw_id_fields = ('employee',)
 
 
 admin.site.register(WorkDay)
-admin.site.register(CustomerProfile)
-admin.site.register(EmployeeSalary)
@@ -0,0 +1,207 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.db.models import F, Sum
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, PermissionDenied, ValidationError
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from profiles.authentication import ClaimsJWTAuthentication, ClaimsUser
+from profiles.compact import CompactCustomerSerializer, CompactEmployeeSerializer, CompactSerializer
+from profiles.models import CustomerProfile, EmployeeIncomeLedger, EmployeeProfile, EmployeeSalary
+from profiles.payroll import _build_payroll, get_period, months_in_period, weekday_counts
+from profiles.presence import atouch_presence
+from profiles.scoping import get_company_ids
+from profiles.serializers import TokenObtainLifetimeSerializer, TokenRefreshLifetimeSerializer
+from profiles.views import get_period_params
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def error_response(error):
+    # same body as rest_framework.views.exception_handler
+    data = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+    return JsonResponse(data, status=error.status_code, safe=False)
+
+
+async def alist(queryset):
+    return [item async for item in queryset]
+
+
+class AsyncManagerView(View):
+    """
+        Базовый асинхронный view: JWT-аутентификация по claims токена
+        (без запроса к БД для токенов с claims) и доступ только для менеджеров
+    """
+    authentication_class = ClaimsJWTAuthentication
+
+    async def authenticate(self, request):
+        authenticator = self.authentication_class()
+        header = authenticator.get_header(request)
+        if header is None:
+            return None
+        raw_token = authenticator.get_raw_token(header)
+        if raw_token is None:
+            return None
+        user = await authenticator.aget_user(authenticator.get_validated_token(raw_token))
+        await atouch_presence(user.id)
+        return user
+
+    async def get_company_ids(self, request):
+        if isinstance(request.user, ClaimsUser):
+            return request.user.company_ids
+        return await sync_to_async(get_company_ids)(request)
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await self.authenticate(request)
+            if user is None:
+                raise NotAuthenticated()
+            if getattr(user, 'user_type', None) != 1:
+                raise PermissionDenied()
+            request.user = user
+            self.company_ids = await self.get_company_ids(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as error:
+            return error_response(error)
+
+
+class AsyncCompactListView(AsyncManagerView):
+    """
+        method: GET
+        Параметры:
+            after - id последней записи предыдущей страницы
+            page_size - размер страницы (по умолчанию 100, не более 1000)
+        Возвращает:
+            Страницу списка в формате компактного сериализатора и ссылку на следующую
+    """
+    model = None
+    compact_serializer_class = None
+
+    def get_int_param(self, request, name, default):
+        try:
+            return int(request.GET.get(name, default))
+        except ValueError:
+            raise ValidationError({name: ['Ожидается число']})
+
+    async def get(self, request):
+        after = self.get_int_param(request, 'after', 0)
+        page_size = max(1, min(self.get_int_param(request, 'page_size', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+
+        compact = self.compact_serializer_class(context={'request': request})
+        queryset = self.model.objects.filter(company_id__in=self.company_ids, id__gt=after).order_by('id')
+        rows = await alist(compact.project(queryset)[:page_size + 1])
+
+        next_url = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            params = request.GET.copy()
+            params['after'] = rows[-1]['id']
+            next_url = request.build_absolute_uri('?' + params.urlencode())
+        return JsonResponse({'next': next_url, 'results': await compact.ato_representation(rows)})
+
+
+class AsyncEmployeeListView(AsyncCompactListView):
+    model = EmployeeProfile
+    compact_serializer_class = CompactEmployeeSerializer
+
+
+class AsyncCustomersListView(AsyncCompactListView):
+    model = CustomerProfile
+    compact_serializer_class = CompactCustomerSerializer
+
+
+class AsyncEmployeeDetailView(AsyncManagerView):
+    """
+        method: GET
+        Возвращает:
+            Все данные о конкретном сотруднике
+    """
+
+    async def get(self, request, pk):
+        compact = CompactEmployeeSerializer(context={'request': request})
+        employees = EmployeeProfile.objects.filter(company_id__in=self.company_ids, pk=pk)
+        row = await compact.project(employees).afirst()
+        if row is None:
+            raise NotFound()
+        links = await alist(compact.schedule_links([pk]))
+        # the base class builds the rows without the schedule query
+        data = CompactSerializer.to_representation(compact, [row])
+        return JsonResponse(compact.attach_schedules(data, links)[0])
+
+
+class AsyncEmployeeSalaryView(AsyncManagerView):
+    """
+        method: GET
+        Параметры:
+            date_from, date_to - период расчета (по умолчанию текущий месяц)
+        Возвращает:
+            Зарплату сотрудника за период
+    """
+
+    async def get(self, request, pk):
+        date_from, date_to = get_period(*get_period_params(request))
+        employees = EmployeeProfile.objects.filter(company_id__in=self.company_ids, pk=pk)
+        through = EmployeeProfile.work_schedule.through
+
+        # the async ORM runs queries one after another in a single thread,
+        # so there is nothing to gain from gather(); stop early on a miss
+        if not await employees.aexists():
+            raise NotFound()
+        salary = await EmployeeSalary.objects.filter(employee__in=employees).afirst()
+        income = await EmployeeIncomeLedger.objects.filter(
+            employee__in=employees,
+            company_id=F('employee__company_id'),
+            date__range=(date_from, date_to),
+        ).aaggregate(income=Sum('income'))
+        weekdays = await alist(through.objects.filter(
+            employeeprofile__in=employees,
+            workday__day_type=1,
+            workday__working_hours__gt=0,
+        ).values_list('workday__day_of_the_week', flat=True).distinct())
+        return JsonResponse(_build_payroll(
+            pk, salary, income['income'], set(weekdays),
+            weekday_counts(date_from, date_to),
+            months_in_period(date_from, date_to)
+        ))
+
+
+class AsyncTokenView(View):
+    """
+        Асинхронные варианты выдачи и обновления JWT токенов: проверка пароля
+        и запросы сериализатора выполняются в пуле потоков
+    """
+    serializer_class = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # token endpoints authenticate with the request body, like DRF's APIView
+        view.csrf_exempt = True
+        return view
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'detail': 'Некорректный JSON'}, status=400)
+
+        serializer = self.serializer_class(data=data, context={'request': request})
+        try:
+            await sync_to_async(serializer.is_valid)(raise_exception=True)
+        except TokenError as error:
+            return error_response(InvalidToken(error.args[0]))
+        except APIException as error:
+            return error_response(error)
+        return JsonResponse(serializer.validated_data)
+
+
+class AsyncTokenObtainPairView(AsyncTokenView):
+    serializer_class = TokenObtainLifetimeSerializer
+
+
+class AsyncTokenRefreshView(AsyncTokenView):
+    serializer_class = TokenRefreshLifetimeSerializer
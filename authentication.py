@@ -0,0 +1,87 @@
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from profiles.presence import touch_presence
+from profiles.scoping import aget_scope_version, get_scope_version, resolve_company_ids
+
+
+def user_claims(user_id, username, user_type, is_staff=False, is_superuser=False):
+    return {
+        'username': username,
+        'user_type': user_type,
+        'is_staff': is_staff,
+        'is_superuser': is_superuser,
+        'company_ids': resolve_company_ids(user_id, user_type),
+        'scope_version': get_scope_version(user_id),
+    }
+
+
+def add_user_claims(token, user):
+    # simplejwt tokens support item assignment only, there is no update()
+    for claim, value in user_claims(user.id, user.username, user.user_type, user.is_staff, user.is_superuser).items():
+        token[claim] = value
+    return token
+
+
+class ClaimsUser(TokenUser):
+    '''
+    Lightweight request.user built from token claims, without a User row fetch.
+    '''
+
+    @property
+    def user_type(self):
+        return self.token.get('user_type')
+
+    @property
+    def company_ids(self):
+        return self.token.get('company_ids', [])
+
+    @property
+    def is_active(self):
+        return True
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    '''
+    Stateless JWT authentication: tokens issued with role and company claims
+    are trusted as long as their scope_version is current. Older tokens
+    without claims fall back to the regular User lookup.
+    '''
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            # JWT requests never send user_logged_in, presence follows activity
+            touch_presence(result[0].id)
+        return result
+
+    def get_claims_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+    def get_user(self, validated_token):
+        if 'scope_version' not in validated_token:
+            return super().get_user(validated_token)
+
+        user_id = self.get_claims_user_id(validated_token)
+        if validated_token['scope_version'] != get_scope_version(user_id):
+            raise InvalidToken('Token claims are outdated, refresh the token')
+        return ClaimsUser(validated_token)
+
+    async def aget_user(self, validated_token):
+        '''
+        get_user() for async views: the scope version is read with the async
+        cache and ORM APIs, the User row fallback runs in the thread pool.
+        '''
+        if 'scope_version' not in validated_token:
+            return await sync_to_async(super().get_user)(validated_token)
+
+        user_id = self.get_claims_user_id(validated_token)
+        if validated_token['scope_version'] != await aget_scope_version(user_id):
+            raise InvalidToken('Token claims are outdated, refresh the token')
+        return ClaimsUser(validated_token)
@@ -0,0 +1,95 @@
+from django.apps import apps
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from profiles.scoping import COMPANY_SCOPE_TIMEOUT, _base_request, get_company_ids, resolve_company_ids
+
+
+USER_TYPES = (1, 2, 3, 4)
+
+# Role profile model for each User.user_type
+ROLE_PROFILES = {
+    1: 'ManagerProfile',
+    2: 'SubManagerProfile',
+    3: 'EmployeeProfile',
+    4: 'CustomerProfile',
+}
+
+
+def authorization_cache_key(user_id, user_type):
+    return 'profiles:authorization:%s:%s' % (user_id, user_type)
+
+
+class AuthorizationContext:
+    '''
+    Role and company membership of the request's user. The role comes from
+    the user object (or token claims) without queries; the role profile ID
+    and the company IDs are resolved on first use and cached per user and role.
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.user = user = request.user
+        self.is_authenticated = bool(user and user.is_authenticated)
+        self.user_id = user.id if self.is_authenticated else None
+        self.user_type = getattr(user, 'user_type', None) if self.is_authenticated else None
+        self.is_active = self.is_authenticated and getattr(user, 'is_active', True)
+        self.is_staff = self.is_authenticated and bool(getattr(user, 'is_staff', False))
+        self.is_superuser = self.is_authenticated and bool(getattr(user, 'is_superuser', False))
+
+    @property
+    def is_manager(self):
+        return self.user_type == 1
+
+    @property
+    def is_sub_manager(self):
+        return self.user_type == 2
+
+    @cached_property
+    def _membership(self):
+        if self.user_type not in ROLE_PROFILES:
+            return {'profile_id': None, 'company_ids': []}
+        key = authorization_cache_key(self.user_id, self.user_type)
+        membership = cache.get(key)
+        if membership is None:
+            profile_model = apps.get_model('profiles', ROLE_PROFILES[self.user_type])
+            membership = {
+                'profile_id': profile_model.objects.filter(user_id=self.user_id).values_list('id', flat=True).first(),
+                # managers' companies come from get_company_ids() and its cache
+                'company_ids': [] if self.is_manager else resolve_company_ids(self.user_id, self.user_type),
+            }
+            cache.set(key, membership, COMPANY_SCOPE_TIMEOUT)
+        return membership
+
+    @property
+    def profile_id(self):
+        return self._membership['profile_id']
+
+    @cached_property
+    def company_ids(self):
+        if self.is_manager:
+            return frozenset(get_company_ids(self.request))
+        return frozenset(self._membership['company_ids'])
+
+    def has_company(self, company_id):
+        return company_id in self.company_ids
+
+
+def get_authorization_context(request):
+    '''
+    Returns the AuthorizationContext of the request, created once per request
+    and shared by permission classes, views and function decorators.
+    '''
+    base = _base_request(request)
+    context = getattr(base, '_profiles_authorization', None)
+    if context is None or context.user is not request.user:
+        context = AuthorizationContext(request)
+        base._profiles_authorization = context
+    return context
+
+
+def invalidate_authorization(user_ids):
+    cache.delete_many([
+        authorization_cache_key(user_id, user_type)
+        for user_id in user_ids for user_type in USER_TYPES
+    ])
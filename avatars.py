@@ -0,0 +1,128 @@
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.templatetags.static import static
+from PIL import Image, ImageOps
+
+from profiles.versions import bump_roster_versions
+
+
+logger = logging.getLogger('profiles.avatars')
+
+# Square thumbnail sizes in pixels, exposed by the serializers as avatar_thumbnails.
+AVATAR_SIZES = tuple(getattr(settings, 'PROFILES_AVATAR_SIZES', (40, 80, 160)))
+# Threads resizing uploads in the background.
+AVATAR_WORKERS = getattr(settings, 'PROFILES_AVATAR_WORKERS', 2)
+AVATAR_THUMBNAIL_DIR = 'user_avatars/thumbnails'
+AVATAR_WEBP_QUALITY = 80
+NO_AVATAR = 'profiles/img/no_avatar.png'
+# WebP renders of NO_AVATAR shipped with the app; other sizes get the PNG
+NO_AVATAR_THUMBNAIL = 'profiles/img/no_avatar_%d.webp'
+NO_AVATAR_THUMBNAIL_SIZES = (40, 80, 160)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thumbnail_name(avatar_hash, size):
+    # names depend on the content only, so the files can be cached forever
+    return '%s/%s/%s_%d.webp' % (AVATAR_THUMBNAIL_DIR, avatar_hash[:2], avatar_hash, size)
+
+
+@lru_cache(maxsize=None)
+def _no_avatar_url(size):
+    if size in NO_AVATAR_THUMBNAIL_SIZES:
+        return static(NO_AVATAR_THUMBNAIL % size)
+    return static(NO_AVATAR)
+
+
+def avatar_thumbnails(avatar_hash, request=None):
+    '''
+    Returns {size: url} of the user's thumbnails, or the static
+    no_avatar thumbnails while there are none.
+    '''
+    if avatar_hash:
+        storage = apps.get_model('profiles', 'User')._meta.get_field('avatar').storage
+        urls = {size: storage.url(thumbnail_name(avatar_hash, size)) for size in AVATAR_SIZES}
+    else:
+        urls = {size: _no_avatar_url(size) for size in AVATAR_SIZES}
+    if request is not None:
+        urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+    return {str(size): url for size, url in urls.items()}
+
+
+def render_thumbnails(content):
+    '''
+    Returns {size: WebP bytes} of square thumbnails cropped from the image.
+    '''
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        thumbnails = {}
+        for size in AVATAR_SIZES:
+            output = io.BytesIO()
+            ImageOps.fit(image, (size, size), Image.LANCZOS).save(
+                output, 'WEBP', quality=AVATAR_WEBP_QUALITY, method=4
+            )
+            thumbnails[size] = output.getvalue()
+    return thumbnails
+
+
+def process_avatar(user_id):
+    '''
+    Writes the thumbnails of the user's current avatar and stores its content
+    hash. Returns the hash, or None when the user has no readable avatar.
+    '''
+    User = apps.get_model('profiles', 'User')
+    user = User.objects.filter(pk=user_id).only('id', 'avatar').first()
+    if user is None or not user.avatar:
+        return None
+
+    name = user.avatar.name
+    storage = user.avatar.storage
+    with storage.open(name, 'rb') as source:
+        content = source.read()
+    avatar_hash = hashlib.sha256(content).hexdigest()[:32]
+
+    if not all(storage.exists(thumbnail_name(avatar_hash, size)) for size in AVATAR_SIZES):
+        for size, data in render_thumbnails(content).items():
+            thumbnail = thumbnail_name(avatar_hash, size)
+            if not storage.exists(thumbnail):
+                storage.save(thumbnail, ContentFile(data))
+
+    # update() skips the User signals; a newer upload is left to its own task
+    if User.objects.filter(pk=user_id, avatar=name).update(avatar_hash=avatar_hash):
+        EmployeeProfile = apps.get_model('profiles', 'EmployeeProfile')
+        CustomerProfile = apps.get_model('profiles', 'CustomerProfile')
+        bump_roster_versions('employees', EmployeeProfile.objects.filter(user_id=user_id).values_list('company_id', flat=True))
+        bump_roster_versions('customers', CustomerProfile.objects.filter(user_id=user_id).values_list('company_id', flat=True))
+    return avatar_hash
+
+
+def _process_in_worker(user_id):
+    try:
+        process_avatar(user_id)
+    except Exception:
+        logger.exception('Could not process the avatar of user %s', user_id)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=AVATAR_WORKERS, thread_name_prefix='profiles-avatars')
+        return _executor
+
+
+def schedule_avatar_processing(user_id):
+    return get_executor().submit(_process_in_worker, user_id)
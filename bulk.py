@@ -0,0 +1,239 @@
+import csv
+import io
+import itertools
+import json
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from profiles.hashing import hash_passwords
+from profiles.models import CustomerProfile, EmployeeCapacity, EmployeeProfile, User, WorkDay
+from profiles.search import build_search_text
+from profiles.serializers import CustomerImportRowSerializer
+from profiles.versions import bump_roster_versions
+
+
+BULK_BATCH_SIZE = 500
+
+
+def bulk_create_employees(rows):
+    '''
+    Creates employees from EmployeeSerializer.validated_data dicts with a
+    bulk INSERT per table (users, profiles, missing work days, work_schedule links)
+    inside one transaction. Passwords are hashed beforehand in a process pool. Returns the created EmployeeProfile objects.
+    '''
+    users = []
+    employees = []
+    schedules = []
+    passwords = []
+    for row in rows:
+        row = dict(row)
+        user_data = dict(row.pop('user'))
+        schedules.append(row.pop('work_schedule', []))
+        passwords.append(user_data.pop('password', None))
+        users.append(User(**user_data))
+        employees.append(EmployeeProfile(**row))
+
+    for user, encoded in zip(users, hash_passwords(passwords).hashes):
+        user.password = encoded
+
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=BULK_BATCH_SIZE)
+        for employee, user in zip(employees, users):
+            employee.user = user
+            employee.search_text = build_search_text(user)
+        EmployeeProfile.objects.bulk_create(employees, batch_size=BULK_BATCH_SIZE)
+
+        work_days = WorkDay.objects.intern_many([day for schedule in schedules for day in schedule])
+
+        through = EmployeeProfile.work_schedule.through
+        links = []
+        for employee, schedule in zip(employees, schedules):
+            work_day_ids = {work_days[WorkDay.objects.value_key(day)].id for day in schedule}
+            links.extend(through(employeeprofile_id=employee.id, workday_id=work_day_id)
+                         for work_day_id in work_day_ids)
+        through.objects.bulk_create(links, batch_size=BULK_BATCH_SIZE)
+        # bulk_create skips the signals that maintain the capacity index and roster versions
+        EmployeeCapacity.rebuild(employee_ids=[employee.id for employee in employees])
+        bump_roster_versions('employees', [employee.company_id for employee in employees])
+
+    return employees
+
+
+CUSTOMER_IMPORT_FORMATS = ('csv', 'ndjson', 'json')
+
+CUSTOMER_USER_FIELDS = ('first_name', 'last_name', 'middle_name', 'email', 'phone', 'gender', 'birthdate')
+
+
+class MalformedRow:
+    '''
+    Placeholder yielded for an NDJSON line that is not valid JSON, reported
+    as an error of its row instead of aborting an import whose earlier
+    chunks are already committed.
+    '''
+
+    def __init__(self, error):
+        self.error = error
+
+
+def read_customer_rows(stream, file_format):
+    '''
+    Yields customer rows as dicts from a binary file object.
+    CSV and NDJSON are read line by line; a JSON array is loaded whole.
+    Malformed NDJSON lines are yielded as MalformedRow.
+    '''
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        yield from csv.DictReader(text)
+    elif file_format == 'ndjson':
+        for line in text:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as error:
+                    yield MalformedRow(error)
+    else:
+        yield from json.load(text)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _match_keys(data):
+    keys = []
+    if data.get('phone'):
+        keys.append(('phone', data['phone']))
+    if data.get('email'):
+        keys.append(('email', data['email'].lower()))
+    return keys
+
+
+def _import_customer_chunk(chunk, start, company_id, creator_id, update_existing, unusable_passwords, stats):
+    valid = []
+    seen = set()
+    for offset, row in enumerate(chunk):
+        if isinstance(row, MalformedRow):
+            stats['errors'].append({
+                'index': start + offset,
+                'errors': {'non_field_errors': ['Некорректный JSON: {0}'.format(row.error)]},
+            })
+            continue
+        serializer = CustomerImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            stats['errors'].append({'index': start + offset, 'errors': serializer.errors})
+            continue
+        keys = _match_keys(serializer.validated_data)
+        if seen.intersection(keys):
+            stats['skipped'] += 1
+            continue
+        seen.update(keys)
+        valid.append((start + offset, serializer.validated_data))
+
+    phones = [data['phone'] for _, data in valid if data.get('phone')]
+    emails = [data['email'].lower() for _, data in valid if data.get('email')]
+    existing = {}
+    # emails match case-insensitively, like _match_keys() within the file
+    customers = (
+        CustomerProfile.objects
+        .filter(company_id=company_id)
+        .alias(user_email_lower=Lower('user__email'))
+        .filter(Q(user__phone__in=phones) | Q(user_email_lower__in=emails))
+        .select_related('user')
+    )
+    for customer in customers:
+        for key in _match_keys({'phone': customer.user.phone, 'email': customer.user.email}):
+            existing[key] = customer
+
+    new_rows = []
+    updated = []
+    for index, data in valid:
+        customer = next((existing[key] for key in _match_keys(data) if key in existing), None)
+        if customer is None:
+            new_rows.append((index, data))
+        elif update_existing:
+            for field in CUSTOMER_USER_FIELDS:
+                if field in data:
+                    setattr(customer.user, field, data[field])
+            customer.address = data['address']
+            updated.append(customer)
+        else:
+            stats['skipped'] += 1
+
+    taken = set(
+        User.objects
+        .filter(username__in=[data['username'] for _, data in new_rows])
+        .values_list('username', flat=True)
+    )
+    users = []
+    profiles = []
+    passwords = []
+    for index, data in new_rows:
+        if data['username'] in taken:
+            stats['errors'].append({'index': index, 'errors': {'username': ['Имя пользователя уже занято']}})
+            continue
+        taken.add(data['username'])
+        password = data.get('password')
+        if not unusable_passwords and password:
+            passwords.append((len(users), password))
+        users.append(User(
+            username=data['username'],
+            password=make_password(None),
+            user_type=4,
+            **{field: data[field] for field in CUSTOMER_USER_FIELDS if field in data}
+        ))
+        profiles.append(CustomerProfile(
+            company_id=company_id,
+            creator_id=creator_id,
+            address=data['address']
+        ))
+
+    if passwords:
+        hashes = hash_passwords([password for _, password in passwords]).hashes
+        for (position, _), encoded in zip(passwords, hashes):
+            users[position].password = encoded
+
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=BULK_BATCH_SIZE)
+        for profile, user in zip(profiles, users):
+            profile.user = user
+            profile.search_text = build_search_text(user, profile.address)
+        CustomerProfile.objects.bulk_create(profiles, batch_size=BULK_BATCH_SIZE)
+        if updated:
+            User.objects.bulk_update(
+                [customer.user for customer in updated], CUSTOMER_USER_FIELDS, batch_size=BULK_BATCH_SIZE
+            )
+            for customer in updated:
+                customer.search_text = build_search_text(customer.user, customer.address)
+            CustomerProfile.objects.bulk_update(updated, ['address', 'search_text'], batch_size=BULK_BATCH_SIZE)
+
+    stats['created'] += len(profiles)
+    stats['updated'] += len(updated)
+
+
+def import_customers(rows, company_id, creator_id, update_existing=False,
+                     unusable_passwords=True, chunk_size=1000):
+    '''
+    Imports customers of one company from an iterable of dicts, chunk by chunk.
+    Existing customers of the company are matched by phone or email with
+    an indexed lookup per chunk and either skipped or updated. With
+    unusable_passwords the accounts are created without hashing a password.
+    Returns counters and per-row errors (row indexes are 0-based).
+    '''
+    stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+    start = 0
+    for chunk in _chunks(rows, chunk_size):
+        _import_customer_chunk(
+            chunk, start, company_id, creator_id, update_existing, unusable_passwords, stats
+        )
+        start += len(chunk)
+    if stats['created'] or stats['updated']:
+        bump_roster_versions('customers', [company_id])
+    return stats
@@ -0,0 +1,124 @@
+from rest_framework import serializers
+
+from profiles.avatars import avatar_thumbnails
+from profiles.models import EmployeeProfile, User
+from profiles.serializers import UserSerializer, WorkDaySerializer
+
+
+def _readable_fields(serializer_class):
+    meta = serializer_class.Meta
+    extra_kwargs = getattr(meta, 'extra_kwargs', {})
+    return tuple(
+        name for name in meta.fields
+        if not extra_kwargs.get(name, {}).get('write_only')
+    )
+
+
+USER_FIELDS = _readable_fields(UserSerializer)
+# User columns to read with values(): the model-backed output fields and
+# the hash the avatar_thumbnails URLs are built from
+USER_COLUMNS = tuple(
+    name for name in USER_FIELDS
+    if name in {field.name for field in User._meta.concrete_fields}
+) + ('avatar_hash',)
+WORK_DAY_FIELDS = _readable_fields(WorkDaySerializer)
+
+
+class CompactSerializer:
+    '''
+    Read-only list serializer working on values() rows and producing
+    plain dicts with the same fields as the DRF serializer it mirrors.
+    Subclasses set `fields`, a sequence of (output name, values() lookup);
+    a None lookup marks the nested user.
+    '''
+    fields = ()
+
+    _date = serializers.DateField()
+
+    def __init__(self, context=None):
+        self.request = (context or {}).get('request')
+        self.avatar_storage = User._meta.get_field('avatar').storage
+
+    def lookups(self):
+        lookups = ['user__%s' % name for name in USER_COLUMNS]
+        lookups.extend(lookup for _, lookup in self.fields if lookup is not None)
+        return lookups
+
+    def project(self, queryset):
+        return queryset.values(*self.lookups())
+
+    def avatar_url(self, name):
+        if not name:
+            return None
+        url = self.avatar_storage.url(name)
+        if self.request is not None:
+            return self.request.build_absolute_uri(url)
+        return url
+
+    def user(self, row):
+        user = {name: row.get('user__%s' % name) for name in USER_FIELDS}
+        if 'birthdate' in user and user['birthdate'] is not None:
+            user['birthdate'] = self._date.to_representation(user['birthdate'])
+        if 'avatar' in user:
+            user['avatar'] = self.avatar_url(user['avatar'])
+        if 'avatar_thumbnails' in user:
+            user['avatar_thumbnails'] = avatar_thumbnails(row['user__avatar_hash'], self.request)
+        return user
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        data = []
+        for row in rows:
+            item = {}
+            for name, lookup in self.fields:
+                item[name] = self.user(row) if lookup is None else row[lookup]
+            data.append(item)
+        return data
+
+    async def ato_representation(self, rows):
+        return self.to_representation(rows)
+
+
+class CompactCustomerSerializer(CompactSerializer):
+    fields = (
+        ('id', 'id'),
+        ('user', None),
+        ('creator', 'creator_id'),
+        ('company', 'company_id'),
+        ('address', 'address'),
+    )
+
+
+class CompactEmployeeSerializer(CompactSerializer):
+    fields = (
+        ('id', 'id'),
+        ('user', None),
+        ('category', 'category_id'),
+        ('company', 'company_id'),
+    )
+
+    def schedule_links(self, employee_ids):
+        through = EmployeeProfile.work_schedule.through
+        return (
+            through.objects
+            .filter(employeeprofile_id__in=employee_ids)
+            .order_by('id')
+            .values_list('employeeprofile_id', *['workday__%s' % name for name in WORK_DAY_FIELDS])
+        )
+
+    def attach_schedules(self, data, links):
+        schedules = {item['id']: [] for item in data}
+        for employee_id, *values in links:
+            schedules[employee_id].append(dict(zip(WORK_DAY_FIELDS, values)))
+        for item in data:
+            item['work_schedule'] = schedules[item['id']]
+        return data
+
+    def to_representation(self, rows):
+        data = super().to_representation(rows)
+        return self.attach_schedules(data, self.schedule_links([item['id'] for item in data]))
+
+    async def ato_representation(self, rows):
+        data = super().to_representation(rows)
+        links = [link async for link in self.schedule_links([item['id'] for item in data])]
+        return self.attach_schedules(data, links)
@@ -1,60 +1,57 @@
+from functools import wraps
+
 from django.contrib.auth import REDIRECT_FIELD_NAME
-from django.contrib.auth.decorators import user_passes_test
-from django.http import HttpResponseRedirect, Http404
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
 
-from profiles.models import ManagerProfile, CompanyProfile
+from profiles.authorization import get_authorization_context
 
 
-def sub_manager_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, login_url='login'):
+def role_required(user_type, function=None, redirect_field_name=REDIRECT_FIELD_NAME, login_url='login'):
     '''
-    Decorator for views that checks that the logged in user is a student,
-    redirects to the log-in page if necessary.
+    Decorator for views that checks that the logged in user is active and
+    has the given user_type, redirects to the log-in page if necessary.
     '''
-    actual_decorator = user_passes_test(
-        lambda u: u.is_active and u.user_type == 2,
-        login_url=login_url,
-        redirect_field_name=redirect_field_name
-    )
+    def actual_decorator(view_func):
+        @wraps(view_func)
+        def wrap(request, *args, **kwargs):
+            context = get_authorization_context(request)
+            if context.is_active and context.user_type == user_type:
+                return view_func(request, *args, **kwargs)
+            return redirect_to_login(request.get_full_path(), login_url, redirect_field_name)
+        return wrap
+
     if function:
         return actual_decorator(function)
     return actual_decorator
 
 
-def manager_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, login_url='login'):
+def sub_manager_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, login_url='login'):
     '''
-    Decorator for views that checks that the logged in user is a teacher,
+    Decorator for views that checks that the logged in user is a sub-manager,
     redirects to the log-in page if necessary.
     '''
-    actual_decorator = user_passes_test(
-        lambda u: u.is_active and u.user_type == 1,
-        login_url=login_url,
-        redirect_field_name=redirect_field_name
-    )
-    if function:
-        return actual_decorator(function)
-    return actual_decorator
+    return role_required(2, function, redirect_field_name, login_url)
 
 
-def queryset_to_dict(queryset):
-    b = []
-    for i in queryset:
-        b.append(i.pk)
-    return b
+def manager_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, login_url='login'):
+    '''
+    Decorator for views that checks that the logged in user is a manager,
+    redirects to the log-in page if necessary.
+    '''
+    return role_required(1, function, redirect_field_name, login_url)
 
 
 def company_required(function):
+    '''
+    Decorator for views taking a company `id`: the user has to be
+    a manager of that company, otherwise 404.
+    '''
+    @wraps(function)
     def wrap(request, *args, **kwargs):
-
-        user = request.user
-        manager = ManagerProfile.objects.get(user_id=user.id)
-        manager_compnaies = CompanyProfile.objects.filter(manager_id=manager.id)
-        manager_companies_id_list = queryset_to_dict(manager_compnaies)
-
-        if kwargs["id"] in manager_companies_id_list:
+        context = get_authorization_context(request)
+        if context.is_manager and kwargs["id"] in context.company_ids:
             return function(request, *args, **kwargs)
-        else:
-            raise Http404("Нет доступа к событию {0}".format(kwargs["id"]))
+        raise Http404("Нет доступа к событию {0}".format(kwargs["id"]))
 
-    wrap.__doc__ = function.__doc__
-    wrap.__name__ = function.__name__
     return wrap
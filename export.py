@@ -0,0 +1,87 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from profiles.models import CustomerProfile, EmployeeProfile
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+USER_COLUMNS = (
+    ('user_id', 'user_id'),
+    ('username', 'user__username'),
+    ('first_name', 'user__first_name'),
+    ('last_name', 'user__last_name'),
+    ('middle_name', 'user__middle_name'),
+    ('email', 'user__email'),
+    ('phone', 'user__phone'),
+    ('birthdate', 'user__birthdate'),
+    ('gender', 'user__gender'),
+)
+
+ROSTERS = {
+    'employees': (
+        EmployeeProfile,
+        (('id', 'id'),) + USER_COLUMNS + (
+            ('category_id', 'category_id'),
+            ('company_id', 'company_id'),
+        ),
+    ),
+    'customers': (
+        CustomerProfile,
+        (('id', 'id'),) + USER_COLUMNS + (
+            ('address', 'address'),
+            ('creator_id', 'creator_id'),
+            ('company_id', 'company_id'),
+        ),
+    ),
+}
+
+
+class Echo:
+    '''
+    File-like object for csv.writer that returns the written line
+    instead of buffering it.
+    '''
+
+    def write(self, value):
+        return value
+
+
+def export_rows(roster, company_ids=None, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Returns (column names, row iterator) for the roster. Rows are tuples read
+    through a server-side cursor, so memory does not depend on the table size.
+    '''
+    model, columns = ROSTERS[roster]
+    queryset = model.objects.all()
+    if company_ids is not None:
+        queryset = queryset.filter(company_id__in=company_ids)
+    names = [name for name, _ in columns]
+    lookups = [lookup for _, lookup in columns]
+    rows = queryset.order_by('id').values_list(*lookups).iterator(chunk_size=chunk_size)
+    return names, rows
+
+
+def render_ndjson(names, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def render_csv(names, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(names)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render(export_format, names, rows):
+    if export_format == 'csv':
+        return render_csv(names, rows)
+    return render_ndjson(names, rows)
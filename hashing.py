@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher, make_password
+
+
+logger = logging.getLogger('profiles.hashing')
+
+# PBKDF2 iterations for accounts created by profiles; None keeps the project's
+# default hasher. Lower values are upgraded on the first successful login,
+# because Django rehashes passwords whose hasher must_update().
+HASH_ITERATIONS = getattr(settings, 'PROFILES_PASSWORD_HASH_ITERATIONS', None)
+# Worker processes of the hash_passwords() pool; defaults to the number of CPUs.
+HASH_WORKERS = getattr(settings, 'PROFILES_PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1
+# Batches smaller than this are hashed in-process, a pool is not worth starting.
+HASH_POOL_MIN_BATCH = getattr(settings, 'PROFILES_PASSWORD_HASH_POOL_MIN_BATCH', 8)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+HashingResult = namedtuple('HashingResult', ['hashes', 'count', 'seconds', 'workers', 'algorithm', 'iterations'])
+
+
+class ProfilesPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    '''
+    PBKDF2 with a configurable iteration count. The encoded value uses the
+    regular pbkdf2_sha256 format, so it is verified by the default hasher.
+    '''
+
+    def __init__(self, iterations):
+        self.iterations = iterations
+
+
+def _hasher(iterations):
+    if iterations is None:
+        return get_hasher('default')
+    return ProfilesPBKDF2PasswordHasher(iterations)
+
+
+def hash_password(password, iterations=HASH_ITERATIONS):
+    '''
+    Hashes one password with the configured cost; None gives an unusable password.
+    '''
+    return make_password(password, hasher=_hasher(iterations))
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _hash_chunk(passwords, iterations):
+    hasher = _hasher(iterations)
+    return [make_password(password, hasher=hasher) for password in passwords]
+
+
+def get_pool():
+    '''
+    Returns the process pool shared by all hash_passwords() calls,
+    started with HASH_WORKERS processes on first use.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, initializer=_init_worker)
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def hash_passwords(passwords, iterations=HASH_ITERATIONS, workers=HASH_WORKERS):
+    '''
+    Hashes a batch of passwords on the shared process pool, spread over at
+    most `workers` of its processes, and returns a HashingResult with the
+    hashes (in input order) and the call's metrics.
+    '''
+    passwords = list(passwords)
+    workers = min(workers or 1, HASH_WORKERS, len(passwords)) or 1
+    started = time.perf_counter()
+
+    hashes = None
+    if workers > 1 and len(passwords) >= HASH_POOL_MIN_BATCH:
+        # one chunk per worker, so a call occupies at most `workers` processes
+        size = -(-len(passwords) // workers)
+        chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        pool = get_pool()
+        try:
+            hashes = [encoded for chunk in pool.map(_hash_chunk, chunks, repeat(iterations)) for encoded in chunk]
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by the OS); start a new pool next time
+            logger.warning('password hashing pool is broken, hashing in-process', exc_info=True)
+            _discard_pool(pool)
+    if hashes is None:
+        workers = 1
+        hashes = _hash_chunk(passwords, iterations)
+
+    hasher = _hasher(iterations)
+    result = HashingResult(
+        hashes=hashes,
+        count=len(hashes),
+        seconds=time.perf_counter() - started,
+        workers=workers,
+        algorithm=hasher.algorithm,
+        iterations=getattr(hasher, 'iterations', None),
+    )
+    logger.info(
+        'hashed %d passwords in %.3fs with %d workers (%s, %s iterations)',
+        result.count, result.seconds, result.workers, result.algorithm, result.iterations
+    )
+    return result
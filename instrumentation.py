@@ -0,0 +1,196 @@
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('profiles.metrics')
+
+# Requests issuing more queries than this log their SQL as a warning.
+QUERY_ALARM_THRESHOLD = getattr(settings, 'PROFILES_METRICS_QUERY_ALARM', 50)
+# At most this many statements are kept per request for the alarm log.
+QUERY_ALARM_MAX_SQL = 200
+
+METRICS = {
+    'profiles_request_queries': (
+        'Database queries per request',
+        (1, 2, 5, 10, 20, 50, 100, 200, 500),
+    ),
+    'profiles_request_db_seconds': (
+        'Total database time per request',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'profiles_request_serializer_seconds': (
+        'Serializer time per request',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'profiles_request_seconds': (
+        'Total request time',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'profiles_response_bytes': (
+        'Response body size',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+    ),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label, value):
+        counts, total = self.series.get(label, ([0] * (len(self.buckets) + 1), 0))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-1] += 1
+        self.series[label] = (counts, total + value)
+
+
+class MetricsRegistry:
+    '''
+    In-process histograms of request metrics, labelled by view name.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: Histogram(buckets) for name, (_, buckets) in METRICS.items()}
+
+    def observe(self, view, values):
+        with self.lock:
+            for name, value in values.items():
+                if value is not None:
+                    self.histograms[name].observe(view, value)
+
+    def render(self):
+        '''
+        Returns the metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        with self.lock:
+            for name, (description, _) in METRICS.items():
+                histogram = self.histograms[name]
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s histogram' % name)
+                for view, (counts, total) in sorted(histogram.series.items()):
+                    for bound, count in zip(histogram.buckets + ('+Inf',), counts):
+                        lines.append('%s_bucket{view="%s",le="%s"} %d' % (name, view, bound, count))
+                    lines.append('%s_sum{view="%s"} %s' % (name, view, total))
+                    lines.append('%s_count{view="%s"} %d' % (name, view, counts[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class QueryCollector:
+    '''
+    connection.execute_wrapper() callback counting and timing queries.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+            if len(self.statements) < QUERY_ALARM_MAX_SQL:
+                self.statements.append(sql)
+
+
+class QueryMetricsMiddleware:
+    '''
+    Opt-in middleware recording query count, DB time, serializer time and
+    response size of requests served by views using InstrumentedViewMixin.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        collector = QueryCollector()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(collector))
+            response = self.get_response(request)
+
+        view = getattr(request, 'profiles_metrics_view', None)
+        if view is not None:
+            self.record(request, response, view, collector, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, view, collector, seconds):
+        size = None if response.streaming else len(response.content)
+        values = {
+            'profiles_request_queries': collector.count,
+            'profiles_request_db_seconds': collector.seconds,
+            'profiles_request_serializer_seconds': getattr(request, 'profiles_serializer_seconds', 0.0),
+            'profiles_request_seconds': seconds,
+            'profiles_response_bytes': size,
+        }
+        registry.observe(view, values)
+
+        logger.info(json.dumps({
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': collector.count,
+            'db_seconds': round(collector.seconds, 6),
+            'serializer_seconds': round(values['profiles_request_serializer_seconds'], 6),
+            'seconds': round(seconds, 6),
+            'response_bytes': size,
+        }))
+        if collector.count > QUERY_ALARM_THRESHOLD:
+            logger.warning(
+                '%s %s issued %d queries (threshold %d):\n%s',
+                request.method, request.path, collector.count, QUERY_ALARM_THRESHOLD,
+                '\n'.join(collector.statements)
+            )
+
+
+class InstrumentedViewMixin:
+    '''
+    Marks the request for QueryMetricsMiddleware and times serialization.
+    '''
+
+    def initial(self, request, *args, **kwargs):
+        request._request.profiles_metrics_view = self.__class__.__name__
+        super().initial(request, *args, **kwargs)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        serializer.to_representation = self.timed(serializer.to_representation)
+        return serializer
+
+    def get_compact_serializer(self):
+        serializer = super().get_compact_serializer()
+        serializer.to_representation = self.timed(serializer.to_representation)
+        return serializer
+
+    def timed(self, to_representation):
+        base_request = self.request._request
+
+        def timed_to_representation(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return to_representation(*args, **kwargs)
+            finally:
+                base_request.profiles_serializer_seconds = (
+                    getattr(base_request, 'profiles_serializer_seconds', 0.0) + time.perf_counter() - started
+                )
+
+        return timed_to_representation
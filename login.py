@@ -0,0 +1,49 @@
+from django.apps import apps
+from django.core.cache import cache
+
+from profiles.scoping import COMPANY_LOOKUPS
+
+
+LOGIN_CONTEXT_TIMEOUT = 60 * 60
+
+DEFAULT_LOGIN_CONTEXT = {
+    'company_id': None,
+    'company_name': 'Компания',
+}
+
+
+def login_context_cache_key(user_id):
+    return 'profiles:login_context:%s' % user_id
+
+
+def resolve_login_context(user):
+    '''
+    Returns {'company_id', 'company_name'} of the user's primary company
+    (the one with the lowest id). The role profile and company are read with
+    one joined query chosen by user_type, and the result is cached per user.
+    '''
+    key = login_context_cache_key(user.id)
+    context = cache.get(key)
+    if context is not None:
+        return context
+
+    context = dict(DEFAULT_LOGIN_CONTEXT)
+    lookup = COMPANY_LOOKUPS.get(user.user_type)
+    if lookup is not None:
+        Company = apps.get_model('company', 'Company')
+        company = (
+            Company.objects
+            .filter(**{lookup: user.id})
+            .order_by('id')
+            .values('id', 'name')
+            .first()
+        )
+        if company is not None:
+            context = {'company_id': company['id'], 'company_name': company['name']}
+
+    cache.set(key, context, LOGIN_CONTEXT_TIMEOUT)
+    return context
+
+
+def invalidate_login_context(user_ids):
+    cache.delete_many([login_context_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import ProtectedError, Q
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from django.urls import include, path
+
+from profiles import views
+from profiles.models import EmployeeProfile, User
+from profiles.serializers import TokenObtainLifetimeSerializer
+from profiles.synthetic import generate_company
+
+
+BENCH_PASSWORD = 'bench-password'
+
+# URLconf used while benchmarking: the profiles routes plus the sync token
+# views, which are routed by the project rather than by this app.
+urlpatterns = [
+    path('token/', views.TokenObtainPairView.as_view()),
+    path('token/refresh/', views.TokenRefreshView.as_view()),
+    path('', include('profiles.urls')),
+]
+
+
+async def run_load(client, request, total, concurrency):
+    '''
+    Sends `total` requests from `concurrency` concurrent clients and
+    returns the number of requests per second.
+    '''
+    remaining = [total]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            response = await request(client)
+            if response.status_code != 200:
+                raise CommandError('%s returned %d' % (response.request['PATH_INFO'], response.status_code))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return total / (time.perf_counter() - started)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a synthetic company and compares requests/sec of the sync '
+        'and async profiles endpoints under concurrent clients (ASGI test client)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employees', type=int, default=200)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--events', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--keep', action='store_true', help='Do not delete the synthetic company afterwards')
+        parser.add_argument('--output', help='Also write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        # the endpoints run in other threads, so the data has to be committed
+        company, manager_user = generate_company(
+            employees=options['employees'], customers=options['customers'], events=options['events']
+        )
+        manager_user.set_password(BENCH_PASSWORD)
+        manager_user.save(update_fields=['password'])
+        try:
+            with override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+                results = asyncio.run(self.bench(company, manager_user, options))
+        finally:
+            if not options['keep']:
+                self.cleanup(company, manager_user)
+
+        for name, result in results.items():
+            self.stdout.write('%-20s sync %8.1f req/s   async %8.1f req/s   x%.2f' % (
+                name, result['sync'], result['async'], result['async'] / result['sync']
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+
+    def cases(self, company, manager_user, page_size):
+        token = TokenObtainLifetimeSerializer.get_token(manager_user)
+        auth = {'HTTP_AUTHORIZATION': 'Bearer %s' % token.access_token}
+        employee_id = EmployeeProfile.objects.filter(company=company).order_by('id').values_list('id', flat=True).first()
+        credentials = json.dumps({'username': manager_user.username, 'password': BENCH_PASSWORD})
+
+        def get(path, params=None):
+            return lambda client: client.get(path, params or {}, **auth)
+
+        def post(path, body):
+            return lambda client: client.post(path, body, content_type='application/json')
+
+        page = {'page_size': page_size}
+        return [
+            ('employees', get('/employees/', page), get('/async/employees/', page)),
+            ('employee detail', get('/employees/%d/' % employee_id), get('/async/employees/%d/' % employee_id)),
+            ('employee salary', get('/employees/%d/salary/' % employee_id),
+             get('/async/employees/%d/salary/' % employee_id)),
+            ('customers', get('/customers/', page), get('/async/customers/', page)),
+            ('token', post('/token/', credentials), post('/async/token/', credentials)),
+            ('token refresh', post('/token/refresh/', json.dumps({'refresh': str(token)})),
+             post('/async/token/refresh/', json.dumps({'refresh': str(token)}))),
+        ]
+
+    async def bench(self, company, manager_user, options):
+        cases = await sync_to_async(self.cases)(company, manager_user, options['page_size'])
+        client = AsyncClient()
+        results = {}
+        for name, sync_request, async_request in cases:
+            results[name] = {}
+            for mode, request in (('sync', sync_request), ('async', async_request)):
+                # warm-up: caches, token scope versions, connections
+                await run_load(client, request, options['concurrency'], options['concurrency'])
+                results[name][mode] = await run_load(
+                    client, request, options['requests'], options['concurrency']
+                )
+        return results
+
+    def cleanup(self, company, manager_user):
+        users = User.objects.filter(
+            Q(employeeprofile__company=company) | Q(customerprofile__company=company)
+        )
+        try:
+            users.delete()
+            company.delete()
+            manager_user.delete()
+        except ProtectedError as error:
+            self.stderr.write('Synthetic company %s was not fully deleted: %s' % (company.pk, error))
@@ -0,0 +1,192 @@
+import json
+import os
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from profiles import views
+from profiles.compact import CompactCustomerSerializer, CompactEmployeeSerializer
+from profiles.models import CustomerProfile, EmployeeProfile
+from profiles.serializers import CustomerSerializer, EmployeeSerializer
+from profiles.synthetic import generate_company
+
+
+class Rollback(Exception):
+    pass
+
+
+def isolated_caches():
+    '''
+    Replaces every configured cache with a private local-memory one, so the
+    benchmark starts cold without flushing the caches the site is using.
+    '''
+    return override_settings(CACHES={
+        alias: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'profiles-bench-%s' % alias,
+        }
+        for alias in settings.CACHES
+    })
+
+
+def measure(func, repeat):
+    '''
+    Runs func once to warm caches, `repeat` times for the best wall time and
+    query count, and once more under tracemalloc for the peak memory.
+    '''
+    func()
+    best = None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            func()
+            seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'queries': len(context.captured_queries), 'seconds': round(best, 6), 'peak_kb': peak // 1024}
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates synthetic companies at several scales, benchmarks the profiles '
+        'endpoints and serializers and compares the results with a JSON baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000,100000',
+                            help='Comma-separated numbers of customers per synthetic company')
+        parser.add_argument('--baseline', default='profiles_bench_baseline.json')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Write the results as the new baseline instead of comparing')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative growth of time and memory')
+        parser.add_argument('--time-floor', type=float, default=0.005,
+                            help='Absolute time growth in seconds always tolerated')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--output', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        results = {}
+        for scale in [int(value) for value in options['scales'].split(',')]:
+            self.stdout.write('Benchmarking scale %d...' % scale)
+            results[str(scale)] = self.run_scale(scale, options)
+
+        if options['output']:
+            self.write_json(options['output'], results)
+
+        if options['update_baseline'] or not os.path.exists(options['baseline']):
+            self.write_json(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS('Baseline written to %s' % options['baseline']))
+            return
+
+        with open(options['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = self.compare(baseline, results, options['tolerance'], options['time_floor'])
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against %s' % options['baseline']))
+
+    def write_json(self, path, data):
+        with open(path, 'w') as output:
+            json.dump(data, output, indent=2, sort_keys=True)
+
+    def run_scale(self, scale, options):
+        results = {}
+        try:
+            with isolated_caches(), transaction.atomic():
+                company, manager_user = generate_company(
+                    employees=max(1, scale // 10), customers=scale, events=scale, seed=scale
+                )
+                cache.clear()
+                for name, func in self.cases(company, manager_user, options['page_size']):
+                    results[name] = measure(func, options['repeat'])
+                    self.stdout.write('  %-36s %s' % (name, results[name]))
+                self.report_speedups(results)
+                raise Rollback()
+        except Rollback:
+            pass
+        return results
+
+    def cases(self, company, manager_user, page_size):
+        factory = APIRequestFactory()
+
+        def endpoint(view_class, path, params=None, **kwargs):
+            view = view_class.as_view(**kwargs.pop('initkwargs', {}))
+
+            def run():
+                request = factory.get(path, params or {})
+                force_authenticate(request, user=manager_user)
+                response = view(request, **kwargs)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                else:
+                    response.render()
+                if response.status_code != 200:
+                    raise CommandError('%s returned %d' % (path, response.status_code))
+            return run
+
+        employee = EmployeeProfile.objects.filter(company=company).order_by('id').first()
+        employees = EmployeeProfile.objects.filter(company=company).order_by('id')
+        customers = CustomerProfile.objects.filter(company=company).order_by('id')
+        page = {'page_size': page_size}
+
+        return [
+            ('EmployeeListView', endpoint(views.EmployeeListView, '/employees/', page)),
+            ('EmployeeDetailView', endpoint(views.EmployeeDetailView, '/employees/%d/' % employee.pk, pk=employee.pk)),
+            ('EmployeeEventsListView', endpoint(views.EmployeeEventsListView, '/employees/events/', page)),
+            ('EmployeeCategoryListCreateView', endpoint(views.EmployeeCategoryListCreateView, '/employees/category/')),
+            ('EmployeeSalaryView', endpoint(views.EmployeeSalaryView, '/employees/%d/salary/' % employee.pk, pk=employee.pk)),
+            ('CompanyPayrollView', endpoint(views.CompanyPayrollView, '/employees/salary/')),
+            ('CustomersListView', endpoint(views.CustomersListView, '/customers/', page)),
+            ('CustomerExport', endpoint(
+                views.RosterExportView, '/customers/export/', initkwargs={'roster': 'customers'})),
+            ('CustomerSearch', endpoint(
+                views.ProfileSearchView, '/customers/search/', {'q': 'иванов'},
+                initkwargs={'model': CustomerProfile, 'serializer_class': CustomerSerializer})),
+            ('EmployeeSerializer', lambda: EmployeeSerializer(
+                employees.select_related('user', 'category', 'company').prefetch_related('work_schedule'),
+                many=True).data),
+            ('CustomerSerializer', lambda: CustomerSerializer(
+                customers.select_related('user', 'creator', 'company'), many=True).data),
+            ('EmployeeCompactSerializer', lambda: CompactEmployeeSerializer().to_representation(
+                CompactEmployeeSerializer().project(employees))),
+            ('CustomerCompactSerializer', lambda: CompactCustomerSerializer().to_representation(
+                CompactCustomerSerializer().project(customers))),
+        ]
+
+    def report_speedups(self, results):
+        for drf, compact in (('EmployeeSerializer', 'EmployeeCompactSerializer'),
+                             ('CustomerSerializer', 'CustomerCompactSerializer')):
+            if results.get(compact, {}).get('seconds'):
+                self.stdout.write('  %-36s x%.1f' % (
+                    '%s speedup' % compact, results[drf]['seconds'] / results[compact]['seconds']
+                ))
+
+    def compare(self, baseline, results, tolerance, time_floor):
+        regressions = []
+        for scale, cases in results.items():
+            for name, current in cases.items():
+                previous = baseline.get(scale, {}).get(name)
+                if previous is None:
+                    continue
+                if current['queries'] > previous['queries']:
+                    regressions.append('%s @%s: queries %d -> %d' % (name, scale, previous['queries'], current['queries']))
+                if current['seconds'] > previous['seconds'] * (1 + tolerance) + time_floor:
+                    regressions.append('%s @%s: seconds %.4f -> %.4f' % (name, scale, previous['seconds'], current['seconds']))
+                if current['peak_kb'] > previous['peak_kb'] * (1 + tolerance) + 64:
+                    regressions.append('%s @%s: peak_kb %d -> %d' % (name, scale, previous['peak_kb'], current['peak_kb']))
+        return regressions
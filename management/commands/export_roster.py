@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from profiles.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, ROSTERS, export_rows, render
+
+
+class Command(BaseCommand):
+    help = 'Streams the employee or customer roster as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', choices=sorted(ROSTERS))
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--company', type=int, action='append', dest='company_ids',
+                            help='Only export this company (repeatable)')
+        parser.add_argument('--output', help='Output file, stdout by default')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        names, rows = export_rows(options['roster'], options['company_ids'], options['chunk_size'])
+        lines = render(options['export_format'], names, rows)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
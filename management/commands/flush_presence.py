@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from profiles.presence import flush_presence
+
+
+class Command(BaseCommand):
+    help = 'Writes cached online presence back to User.is_online in batched updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = flush_presence(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Updated is_online for %d users' % updated))
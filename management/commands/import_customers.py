@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from profiles.bulk import CUSTOMER_IMPORT_FORMATS, import_customers, read_customer_rows
+
+
+class Command(BaseCommand):
+    help = 'Imports customers of a company from a CSV, NDJSON or JSON file in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--company', type=int, required=True)
+        parser.add_argument('--creator', type=int, required=True, help='ManagerProfile id')
+        parser.add_argument('--format', dest='file_format', choices=CUSTOMER_IMPORT_FORMATS)
+        parser.add_argument('--on-conflict', choices=('skip', 'update'), default='skip')
+        parser.add_argument('--keep-passwords', action='store_true',
+                            help='Hash passwords from the file instead of creating unusable ones')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        file_format = options['file_format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if file_format not in CUSTOMER_IMPORT_FORMATS:
+            raise CommandError('Unknown format %s, use --format' % file_format)
+
+        with open(options['path'], 'rb') as stream:
+            stats = import_customers(
+                read_customer_rows(stream, file_format),
+                company_id=options['company'],
+                creator_id=options['creator'],
+                update_existing=options['on_conflict'] == 'update',
+                unusable_passwords=not options['keep_passwords'],
+                chunk_size=options['chunk_size'],
+            )
+
+        for error in stats['errors']:
+            self.stderr.write('Row %(index)d: %(errors)s' % error)
+        self.stdout.write(self.style.SUCCESS(
+            'Created: %(created)d, updated: %(updated)d, skipped: %(skipped)d' % stats
+        ))
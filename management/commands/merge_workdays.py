@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from profiles.models import WorkDay
+
+
+class Command(BaseCommand):
+    help = 'Merges duplicate WorkDay rows so every (day, hours, type) value is stored once'
+
+    def handle(self, *args, **options):
+        removed = WorkDay.objects.merge_duplicates()
+        self.stdout.write(self.style.SUCCESS('Removed %d duplicate work days' % removed))
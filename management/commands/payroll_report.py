@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from profiles.export import render_csv
+from profiles.payroll import PeriodError, parse_period, payroll_report
+
+
+class Command(BaseCommand):
+    help = 'Writes the payroll of every employee of the given companies as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='company_ids', required=True,
+                            help='Company to include (repeatable)')
+        parser.add_argument('--date-from', dest='date_from', help='First day of the period, YYYY-MM-DD')
+        parser.add_argument('--date-to', dest='date_to', help='Last day of the period, YYYY-MM-DD')
+        parser.add_argument('--output', help='Output file, stdout by default')
+
+    def _parse_period(self, options):
+        try:
+            return parse_period(options['date_from'], options['date_to'])
+        except PeriodError as error:
+            raise CommandError('--%s: %s' % (error.bound.replace('_', '-'), error.message))
+
+    def handle(self, *args, **options):
+        names, rows = payroll_report(options['company_ids'], *self._parse_period(options))
+        lines = render_csv(names, rows)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
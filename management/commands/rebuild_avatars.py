@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from profiles.avatars import AVATAR_WORKERS, process_avatar
+from profiles.models import User
+
+
+class Command(BaseCommand):
+    help = 'Generates the WebP avatar thumbnails and content hashes of uploaded avatars'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Reprocess every avatar, not only the ones without a hash')
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only process this user (repeatable)')
+        parser.add_argument('--workers', type=int, default=AVATAR_WORKERS)
+
+    def process(self, user_id):
+        try:
+            return user_id, process_avatar(user_id), None
+        except Exception as error:
+            return user_id, None, error
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if not options['all']:
+            users = users.filter(avatar_hash='')
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+        user_ids = list(users.order_by('id').values_list('id', flat=True))
+
+        processed = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            for user_id, avatar_hash, error in executor.map(self.process, user_ids):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write('User %s: %s' % (user_id, error))
+                elif avatar_hash is not None:
+                    processed += 1
+        self.stdout.write(self.style.SUCCESS('Avatars processed: %d, failed: %d' % (processed, failed)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from profiles.models import EmployeeCapacity
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-employee weekly capacity index from work schedules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='company_ids',
+                            help='Only rebuild rows of this company (repeatable)')
+        parser.add_argument('--employee', type=int, action='append', dest='employee_ids',
+                            help='Only rebuild rows of this employee (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        written = EmployeeCapacity.rebuild(
+            company_ids=options['company_ids'],
+            employee_ids=options['employee_ids'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS('Capacity index rebuilt: %d rows' % written))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from profiles.models import EmployeeIncomeLedger
+from profiles.payroll import PeriodError, parse_period
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds (or backfills) the per-employee daily income ledger from events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='company_ids',
+                            help='Only rebuild rows of this company (repeatable)')
+        parser.add_argument('--employee', type=int, action='append', dest='employee_ids',
+                            help='Only rebuild rows of this employee (repeatable)')
+        parser.add_argument('--service', type=int, action='append', dest='service_ids',
+                            help='Only rebuild the employees and days with events of this service '
+                                 '(repeatable, not combined with the other filters)')
+        parser.add_argument('--date-from', dest='date_from', help='First day to rebuild, YYYY-MM-DD')
+        parser.add_argument('--date-to', dest='date_to', help='Last day to rebuild, YYYY-MM-DD')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def _parse_period(self, options):
+        try:
+            return parse_period(options['date_from'], options['date_to'])
+        except PeriodError as error:
+            raise CommandError('--%s: %s' % (error.bound.replace('_', '-'), error.message))
+
+    def handle(self, *args, **options):
+        if options['service_ids']:
+            if options['company_ids'] or options['employee_ids'] or options['date_from'] or options['date_to']:
+                raise CommandError('--service cannot be combined with the other filters')
+            written = EmployeeIncomeLedger.rebuild_services(options['service_ids'], batch_size=options['batch_size'])
+        else:
+            date_from, date_to = self._parse_period(options)
+            written = EmployeeIncomeLedger.rebuild(
+                company_ids=options['company_ids'],
+                employee_ids=options['employee_ids'],
+                date_from=date_from,
+                date_to=date_to,
+                batch_size=options['batch_size'],
+            )
+        self.stdout.write(self.style.SUCCESS('Income ledger rebuilt: %d rows' % written))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from profiles.search import install_search_indexes, rebuild_search_text
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the profiles search column and creates its n-gram index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        install_search_indexes(options['database'])
+        updated = rebuild_search_text(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Search text rebuilt for %d profiles' % updated))
@@ -0,0 +1,52 @@
+from rest_framework.response import Response
+
+
+def optimize_queryset(queryset, serializer_class):
+    '''
+    Applies the select_related / prefetch_related plan declared
+    on the serializer's Meta to the queryset.
+    '''
+    meta = getattr(serializer_class, 'Meta', None)
+    select_related = getattr(meta, 'select_related', ())
+    prefetch_related = getattr(meta, 'prefetch_related', ())
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+class QuerysetOptimizationMixin:
+    '''
+    Mixin for generic views: every queryset passed through filter_queryset
+    (lists and get_object) gets the serializer's related-object plan,
+    so the number of queries does not grow with the number of rows.
+    '''
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return optimize_queryset(queryset, self.get_serializer_class())
+
+
+class CompactListMixin:
+    '''
+    Mixin for list views: when compact_serializer_class is set, lists are
+    projected with values() and rendered by the compact serializer
+    instead of the DRF serializer_class.
+    '''
+    compact_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.compact_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+
+        compact = self.get_compact_serializer()
+        queryset = compact.project(self.filter_queryset(self.get_queryset()).prefetch_related(None))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compact.to_representation(page))
+        return Response(compact.to_representation(queryset))
+
+    def get_compact_serializer(self):
+        return self.compact_serializer_class(context=self.get_serializer_context())
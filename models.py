@@ -1,13 +1,28 @@
-from django.db import models
+import datetime
+
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Lower, TruncDate
 from django.contrib.auth.models import AbstractUser
 from django.dispatch import receiver
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed, post_migrate
 from django.conf import settings
+from django.utils import timezone
 from django.core.validators import MaxValueValidator, MinValueValidator
 from slugify import slugify
 
+from profiles.authorization import invalidate_authorization
+from profiles.login import invalidate_login_context
+from profiles.scoping import bump_scope_versions, company_user_ids, invalidate_company_scope
+from profiles.versions import bump_roster_versions
+
+
+# Event field holding the appointment date, used for ledger days and payroll periods.
+EVENT_DATE_FIELD = 'start'
+
 
 class User(AbstractUser):
     USER_TYPE_CHOICES = (
@@ -50,6 +65,12 @@ class User(AbstractUser):
         blank=True, null=True, 
         verbose_name="Аватар"
     )
+    avatar_hash = models.CharField(
+        max_length=32,
+        blank=True, default='',
+        editable=False,
+        verbose_name="Хэш аватара"
+    )
     gender = models.PositiveSmallIntegerField(
         choices=GENDER_CHOICES, 
         blank=True, null=True, 
@@ -67,6 +88,98 @@ class User(AbstractUser):
     )
     is_online = models.BooleanField(default=False)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['phone'], name='profiles_user_phone_idx'),
+            models.Index(Lower('email'), name='profiles_user_email_lower_idx'),
+        ]
+
+
+class UserScope(models.Model):
+    """
+    Durable scope version of a user, compared with the scope_version claim
+    of JWT tokens. Kept out of the User row so that saving a stale User
+    instance can never roll the version back. A missing row means version 1.
+    """
+    user = models.OneToOneField(
+        to=get_user_model(),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='scope',
+        verbose_name='Пользователь'
+    )
+    version = models.PositiveIntegerField(
+        default=1,
+        verbose_name='Версия прав доступа'
+    )
+
+    class Meta:
+        verbose_name = "Версия прав доступа пользователя"
+        verbose_name_plural = "Версии прав доступа пользователей"
+
+
+class WorkDayManager(models.Manager):
+
+    @staticmethod
+    def value_key(value):
+        if isinstance(value, WorkDay):
+            return (value.day_of_the_week, value.working_hours, value.day_type)
+        return (value['day_of_the_week'], value['working_hours'], value['day_type'])
+
+    def _fetch(self, keys):
+        condition = models.Q()
+        for day, hours, day_type in keys:
+            condition |= models.Q(day_of_the_week=day, working_hours=hours, day_type=day_type)
+        return {self.value_key(work_day): work_day for work_day in self.filter(condition)}
+
+    def intern_many(self, values):
+        """
+        Returns {(day_of_the_week, working_hours, day_type): WorkDay} for the given
+        dicts, reusing existing rows and inserting the missing ones in bulk.
+        """
+        keys = {self.value_key(value) for value in values}
+        if not keys:
+            return {}
+        work_days = self._fetch(keys)
+        missing = keys - set(work_days)
+        if missing:
+            self.bulk_create(
+                [WorkDay(day_of_the_week=day, working_hours=hours, day_type=day_type)
+                 for day, hours, day_type in missing],
+                ignore_conflicts=True
+            )
+            work_days.update(self._fetch(missing))
+        return work_days
+
+    def merge_duplicates(self):
+        """
+        Collapses rows with equal values into the one with the lowest id and
+        moves work_schedule links onto it. Returns the number of removed rows.
+        """
+        groups = {}
+        for work_day in self.order_by('id'):
+            groups.setdefault(self.value_key(work_day), []).append(work_day.id)
+
+        through = EmployeeProfile.work_schedule.through
+        removed = 0
+        with transaction.atomic():
+            for ids in groups.values():
+                if len(ids) < 2:
+                    continue
+                canonical, duplicates = ids[0], ids[1:]
+                employee_ids = set(
+                    through.objects.filter(workday_id__in=duplicates).values_list('employeeprofile_id', flat=True)
+                )
+                through.objects.filter(workday_id__in=duplicates).delete()
+                through.objects.bulk_create(
+                    [through(employeeprofile_id=employee_id, workday_id=canonical) for employee_id in employee_ids],
+                    ignore_conflicts=True
+                )
+                removed += self.filter(id__in=duplicates).delete()[1].get(WorkDay._meta.label, 0)
+                bump_roster_versions('employees', EmployeeProfile.objects.filter(
+                    id__in=employee_ids).values_list('company_id', flat=True))
+        return removed
+
 
 class WorkDay(models.Model):
 
@@ -99,10 +212,15 @@ class WorkDay(models.Model):
         choices=DAY_TYPES
     )
 
+    objects = WorkDayManager()
+
     def __str__(self) -> str:
         days = dict(self.DAYS_OF_THE_WEEK)
         return str(days[self.day_of_the_week])
 
+    class Meta:
+        unique_together = ('day_of_the_week', 'working_hours', 'day_type')
+
 
 class EmployeeProfile(models.Model):
     user = models.OneToOneField(
@@ -127,6 +245,11 @@ class EmployeeProfile(models.Model):
         verbose_name="График работы",
         related_name='employees'
     )
+    search_text = models.TextField(
+        blank=True, default='',
+        editable=False,
+        verbose_name='Текст для поиска'
+    )
 
     def __str__(self):
         return " %s" % self.user.username
@@ -134,6 +257,9 @@ class EmployeeProfile(models.Model):
     class Meta:
         verbose_name = "Сотрудник"
         verbose_name_plural = "Сотрудники"
+        indexes = [
+            models.Index(fields=['company', 'category'], name='profiles_emp_company_cat_idx'),
+        ]
     
 
 class EmployeeSalary(models.Model):
@@ -168,6 +294,232 @@ class EmployeeSalary(models.Model):
         verbose_name_plural = "Оклады сотрудников"
 
 
+class EmployeeIncomeLedger(models.Model):
+    employee = models.ForeignKey(
+        to=EmployeeProfile,
+        on_delete=models.CASCADE,
+        related_name='income_ledger',
+        verbose_name='Сотрудник'
+    )
+    company = models.ForeignKey(
+        to='company.Company',
+        on_delete=models.CASCADE,
+        related_name='income_ledger',
+        verbose_name='Компания'
+    )
+    date = models.DateField(
+        verbose_name='Дата'
+    )
+    income = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        verbose_name='Доход'
+    )
+    events_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество записей'
+    )
+
+    @staticmethod
+    def event_day(event):
+        value = getattr(event, EVENT_DATE_FIELD)
+        if isinstance(value, datetime.datetime):
+            if timezone.is_aware(value):
+                return timezone.localdate(value)
+            return value.date()
+        return value
+
+    @classmethod
+    def refresh(cls, employee_id, company_id, day):
+        """
+        Recomputes the ledger row of one employee for one day from its events.
+        """
+        if employee_id is None or company_id is None or day is None:
+            return
+        Event = apps.get_model('events', 'Event')
+        totals = Event.objects.filter(
+            employee_id=employee_id,
+            company_id=company_id,
+            **{EVENT_DATE_FIELD + '__date': day}
+        ).aggregate(income=Sum('service__price'), events_count=Count('id'))
+
+        if not totals['events_count']:
+            cls.objects.filter(employee_id=employee_id, company_id=company_id, date=day).delete()
+            return
+        cls.objects.update_or_create(
+            employee_id=employee_id,
+            company_id=company_id,
+            date=day,
+            defaults={
+                'income': totals['income'] or 0,
+                'events_count': totals['events_count'],
+            }
+        )
+
+    @classmethod
+    def rebuild(cls, company_ids=None, employee_ids=None, date_from=None, date_to=None, batch_size=1000):
+        """
+        Drops and recomputes the ledger rows matching the filters
+        with one grouped aggregate over events. Returns the number of rows written.
+        """
+        Event = apps.get_model('events', 'Event')
+        ledger = cls.objects.all()
+        events = Event.objects.filter(employee__isnull=False)
+        if company_ids is not None:
+            ledger = ledger.filter(company_id__in=company_ids)
+            events = events.filter(company_id__in=company_ids)
+        if employee_ids is not None:
+            ledger = ledger.filter(employee_id__in=employee_ids)
+            events = events.filter(employee_id__in=employee_ids)
+        if date_from is not None:
+            ledger = ledger.filter(date__gte=date_from)
+            events = events.filter(**{EVENT_DATE_FIELD + '__date__gte': date_from})
+        if date_to is not None:
+            ledger = ledger.filter(date__lte=date_to)
+            events = events.filter(**{EVENT_DATE_FIELD + '__date__lte': date_to})
+
+        rows = (
+            events
+            .annotate(day=TruncDate(EVENT_DATE_FIELD))
+            .values('employee_id', 'company_id', 'day')
+            .annotate(income=Sum('service__price'), events_count=Count('id'))
+            .order_by()
+        )
+
+        written = 0
+        with transaction.atomic():
+            ledger.delete()
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(cls(
+                    employee_id=row['employee_id'],
+                    company_id=row['company_id'],
+                    date=row['day'],
+                    income=row['income'] or 0,
+                    events_count=row['events_count'],
+                ))
+                if len(batch) >= batch_size:
+                    cls.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            cls.objects.bulk_create(batch)
+            written += len(batch)
+        return written
+
+    @classmethod
+    def rebuild_services(cls, service_ids, batch_size=1000):
+        """
+        Recomputes the ledger of the employees with events of the services
+        over the days those events span, e.g. after a price change.
+        Returns the number of rows written.
+        """
+        Event = apps.get_model('events', 'Event')
+        events = Event.objects.filter(service_id__in=service_ids, employee__isnull=False)
+        employee_ids = list(events.values_list('employee_id', flat=True).distinct().order_by())
+        if not employee_ids:
+            return 0
+        span = events.aggregate(
+            date_from=Min(TruncDate(EVENT_DATE_FIELD)), date_to=Max(TruncDate(EVENT_DATE_FIELD))
+        )
+        return cls.rebuild(employee_ids=employee_ids, batch_size=batch_size, **span)
+
+    class Meta:
+        verbose_name = "Доход сотрудника за день"
+        verbose_name_plural = "Доходы сотрудников по дням"
+        unique_together = ('employee', 'company', 'date')
+
+
+class EmployeeCapacity(models.Model):
+    """
+    Precomputed working hours of an employee per day of the week,
+    denormalized from work_schedule with the company and category.
+    Only working days (weekday type, more than 0 hours) are stored.
+    """
+    employee = models.ForeignKey(
+        to=EmployeeProfile,
+        on_delete=models.CASCADE,
+        related_name='capacity',
+        verbose_name='Сотрудник'
+    )
+    company = models.ForeignKey(
+        to='company.Company',
+        on_delete=models.CASCADE,
+        related_name='capacity',
+        verbose_name='Компания'
+    )
+    category = models.ForeignKey(
+        to='EmployeeCategory',
+        on_delete=models.CASCADE,
+        related_name='capacity',
+        verbose_name='Категория сотрудников'
+    )
+    day_of_the_week = models.IntegerField(
+        verbose_name='day of the week',
+        choices=WorkDay.DAYS_OF_THE_WEEK
+    )
+    working_hours = models.PositiveIntegerField(
+        verbose_name='Рабочие часы'
+    )
+
+    @classmethod
+    def rebuild(cls, company_ids=None, employee_ids=None, batch_size=1000):
+        """
+        Drops and recomputes the rows of the matching employees with one
+        grouped query over the work_schedule table. Returns the number of rows written.
+        """
+        through = EmployeeProfile.work_schedule.through
+        capacity = cls.objects.all()
+        links = through.objects.filter(workday__day_type=1, workday__working_hours__gt=0)
+        if company_ids is not None:
+            capacity = capacity.filter(company_id__in=company_ids)
+            links = links.filter(employeeprofile__company_id__in=company_ids)
+        if employee_ids is not None:
+            capacity = capacity.filter(employee_id__in=employee_ids)
+            links = links.filter(employeeprofile_id__in=employee_ids)
+
+        rows = (
+            links
+            .values(
+                'employeeprofile_id', 'employeeprofile__company_id',
+                'employeeprofile__category_id', 'workday__day_of_the_week'
+            )
+            .annotate(hours=Sum('workday__working_hours'))
+            .order_by()
+        )
+
+        written = 0
+        with transaction.atomic():
+            capacity.delete()
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(cls(
+                    employee_id=row['employeeprofile_id'],
+                    company_id=row['employeeprofile__company_id'],
+                    category_id=row['employeeprofile__category_id'],
+                    day_of_the_week=row['workday__day_of_the_week'],
+                    working_hours=row['hours'],
+                ))
+                if len(batch) >= batch_size:
+                    cls.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            cls.objects.bulk_create(batch)
+            written += len(batch)
+        return written
+
+    class Meta:
+        verbose_name = "Рабочие часы сотрудника по дням недели"
+        verbose_name_plural = "Индекс загрузки сотрудников"
+        unique_together = ('employee', 'day_of_the_week')
+        indexes = [
+            models.Index(
+                fields=['company', 'day_of_the_week', 'category'],
+                name='profiles_capacity_day_idx'
+            ),
+        ]
+
+
 class EmployeeCategory(models.Model):
     name = models.CharField(
         default="Врач", 
@@ -221,6 +573,11 @@ class CustomerProfile(models.Model):
         related_name='customers',
         verbose_name='Компания'
     )
+    search_text = models.TextField(
+        blank=True, default='',
+        editable=False,
+        verbose_name='Текст для поиска'
+    )
     
     def __str__(self):
         return " %s Клиент" % self.user
@@ -228,6 +585,9 @@ class CustomerProfile(models.Model):
     class Meta:
         verbose_name = "Клиент"
         verbose_name_plural = "Клиенты"
+        indexes = [
+            models.Index(fields=['company', 'id'], name='profiles_cust_company_id_idx'),
+        ]
 
 
 class ManagerProfile(models.Model):
@@ -295,17 +655,250 @@ def create_user_profile(sender, instance, created, **kwargs):
             sender.user_type == 4
 
 
+def _ledger_key(event):
+    return (event.employee_id, event.company_id, EmployeeIncomeLedger.event_day(event))
+
+
+@receiver(pre_save, sender='events.Event')
+def remember_event_ledger_key(sender, instance, **kwargs):
+    instance._ledger_previous_key = None
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        if previous is not None:
+            instance._ledger_previous_key = _ledger_key(previous)
+
+
+@receiver(post_save, sender='events.Event')
+def update_income_ledger(sender, instance, **kwargs):
+    keys = {_ledger_key(instance), getattr(instance, '_ledger_previous_key', None)}
+    for key in keys:
+        if key is not None:
+            EmployeeIncomeLedger.refresh(*key)
+
+
+@receiver(post_delete, sender='events.Event')
+def remove_from_income_ledger(sender, instance, **kwargs):
+    EmployeeIncomeLedger.refresh(*_ledger_key(instance))
+
+
+def remember_service_price(sender, instance, **kwargs):
+    instance._ledger_previous_price = None
+    if instance.pk:
+        instance._ledger_previous_price = sender.objects.filter(pk=instance.pk).values_list('price', flat=True).first()
+
+
+def service_price_changed(sender, instance, created, **kwargs):
+    if not created and instance.price != getattr(instance, '_ledger_previous_price', instance.price):
+        EmployeeIncomeLedger.rebuild_services([instance.pk])
+
+
+def connect_service_receivers():
+    # the Service model is only known through Event.service, so the
+    # receivers are connected from ProfilesConfig.ready()
+    Service = apps.get_model('events', 'Event')._meta.get_field('service').related_model
+    pre_save.connect(remember_service_price, sender=Service, dispatch_uid='profiles_remember_service_price')
+    post_save.connect(service_price_changed, sender=Service, dispatch_uid='profiles_service_price_changed')
+
+
+def invalidate_user_caches(user_ids):
+    user_ids = list(user_ids)
+    invalidate_company_scope(user_ids)
+    invalidate_login_context(user_ids)
+    invalidate_authorization(user_ids)
+    bump_scope_versions(user_ids)
+
+
+@receiver(m2m_changed, sender=ManagerProfile.company.through)
+@receiver(m2m_changed, sender=SubManagerProfile.company.through)
+def profile_companies_changed(sender, instance, action, reverse, pk_set, model, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_user_caches([instance.user_id])
+        return
+    # instance is a Company, model is the profile class
+    if pk_set:
+        profiles = model.objects.filter(pk__in=pk_set)
+    else:
+        profiles = model.objects.filter(company=instance)
+    invalidate_user_caches(profiles.values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=EmployeeProfile)
+@receiver(post_delete, sender=EmployeeProfile)
+@receiver(post_delete, sender=ManagerProfile)
+@receiver(post_delete, sender=SubManagerProfile)
+def role_profile_changed(sender, instance, **kwargs):
+    invalidate_user_caches([instance.user_id])
+
+
+@receiver(post_save, sender=ManagerProfile)
+@receiver(post_save, sender=SubManagerProfile)
+@receiver(post_save, sender=CustomerProfile)
+@receiver(post_delete, sender=CustomerProfile)
+def role_profile_saved(sender, instance, **kwargs):
+    invalidate_authorization([instance.user_id])
+
+
+@receiver(post_save, sender='company.Company')
+def company_changed(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_login_context(company_user_ids(instance.id))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_deactivated(sender, instance, created, **kwargs):
+    if not created and not instance.is_active:
+        bump_scope_versions([instance.id])
+
+
+@receiver(pre_save, sender=EmployeeProfile)
+@receiver(pre_save, sender=CustomerProfile)
+def remember_roster_company(sender, instance, **kwargs):
+    instance._roster_previous_company_id = None
+    if instance.pk:
+        instance._roster_previous_company_id = (
+            sender.objects.filter(pk=instance.pk).values_list('company_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=EmployeeProfile)
+@receiver(post_delete, sender=EmployeeProfile)
+def employee_roster_changed(sender, instance, **kwargs):
+    bump_roster_versions('employees', [instance.company_id, getattr(instance, '_roster_previous_company_id', None)])
+
+
+@receiver(post_save, sender=CustomerProfile)
+@receiver(post_delete, sender=CustomerProfile)
+def customer_roster_changed(sender, instance, **kwargs):
+    bump_roster_versions('customers', [instance.company_id, getattr(instance, '_roster_previous_company_id', None)])
+
+
+@receiver(post_save, sender=EmployeeCategory)
+@receiver(post_delete, sender=EmployeeCategory)
+def category_roster_changed(sender, instance, **kwargs):
+    bump_roster_versions('categories', [instance.company_id])
+
+
+@receiver(m2m_changed, sender=EmployeeProfile.work_schedule.through)
+def work_schedule_roster_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        bump_roster_versions('employees', [instance.company_id])
+        return
+    # instance is a WorkDay, pk_set holds employee IDs
+    employees = EmployeeProfile.objects.filter(pk__in=pk_set) if pk_set else instance.employees.all()
+    bump_roster_versions('employees', employees.values_list('company_id', flat=True))
+
+
+@receiver(m2m_changed, sender=EmployeeProfile.work_schedule.through)
+def work_schedule_capacity_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._capacity_employee_ids = list(instance.employees.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        EmployeeCapacity.rebuild(employee_ids=[instance.id])
+    elif action == 'post_clear':
+        EmployeeCapacity.rebuild(employee_ids=getattr(instance, '_capacity_employee_ids', []))
+    else:
+        EmployeeCapacity.rebuild(employee_ids=list(pk_set))
+
+
+@receiver(post_save, sender=WorkDay)
+def work_day_capacity_changed(sender, instance, created, **kwargs):
+    if not created:
+        EmployeeCapacity.rebuild(employee_ids=list(instance.employees.values_list('id', flat=True)))
+
+
+@receiver(pre_delete, sender=WorkDay)
+def remember_work_day_employees(sender, instance, **kwargs):
+    instance._capacity_employee_ids = list(instance.employees.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=WorkDay)
+def work_day_capacity_removed(sender, instance, **kwargs):
+    EmployeeCapacity.rebuild(employee_ids=getattr(instance, '_capacity_employee_ids', []))
+
+
+@receiver(post_save, sender=EmployeeProfile)
+def employee_capacity_moved(sender, instance, created, **kwargs):
+    if not created:
+        EmployeeCapacity.objects.filter(employee=instance).update(
+            company_id=instance.company_id, category_id=instance.category_id
+        )
+
+
+@receiver(post_save, sender=WorkDay)
+@receiver(pre_delete, sender=WorkDay)
+def work_day_roster_changed(sender, instance, **kwargs):
+    bump_roster_versions('employees', instance.employees.values_list('company_id', flat=True))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_roster_changed(sender, instance, created, update_fields, **kwargs):
+    from profiles.compact import USER_COLUMNS
+    # e.g. update_fields=['last_login'] on every login changes nothing listed
+    if created or (update_fields and not set(update_fields) & set(USER_COLUMNS)):
+        return
+    bump_roster_versions('employees', EmployeeProfile.objects.filter(user=instance).values_list('company_id', flat=True))
+    bump_roster_versions('customers', CustomerProfile.objects.filter(user=instance).values_list('company_id', flat=True))
+
+
+@receiver(pre_save, sender=EmployeeProfile)
+@receiver(pre_save, sender=CustomerProfile)
+def fill_profile_search_text(sender, instance, **kwargs):
+    from profiles.search import profile_search_text
+    instance.search_text = profile_search_text(instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def refresh_profile_search_text(sender, instance, created, update_fields, **kwargs):
+    from profiles.search import USER_SEARCH_FIELDS, build_search_text
+    if created or (update_fields and not set(update_fields) & set(USER_SEARCH_FIELDS)):
+        return
+    EmployeeProfile.objects.filter(user=instance).update(search_text=build_search_text(instance))
+    customer = CustomerProfile.objects.filter(user=instance).only('id', 'address').first()
+    if customer is not None:
+        CustomerProfile.objects.filter(pk=customer.pk).update(
+            search_text=build_search_text(instance, customer.address)
+        )
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_avatar_upload(sender, instance, **kwargs):
+    # a newly assigned file is not committed to the storage until the save
+    instance._avatar_uploaded = bool(instance.avatar) and not instance.avatar._committed
+    if not instance.avatar:
+        instance.avatar_hash = ''
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def process_avatar_upload(sender, instance, **kwargs):
+    from profiles.avatars import schedule_avatar_processing
+    if getattr(instance, '_avatar_uploaded', False):
+        user_id = instance.pk
+        transaction.on_commit(lambda: schedule_avatar_processing(user_id))
+
+
+@receiver(post_migrate)
+def create_search_indexes(sender, using, **kwargs):
+    from profiles.search import install_search_indexes
+    if sender.name == 'profiles':
+        # never fail migrate: the index can be created later by rebuild_search_index
+        install_search_indexes(using, fail_silently=True)
+
+
 @receiver(user_logged_in)
 def got_online(sender, user, request, **kwargs):
-    user_id = request.user.id
-    if User.objects.filter(id=user_id).exists():
-        user.is_online = True
-        user.save()
+    from profiles.presence import mark_online
+    mark_online(user.id)
 
 
 @receiver(user_logged_out)
 def got_offline(sender, user, request, **kwargs):
-    user_id = request.user.id
-    if User.objects.filter(id=user_id).exists():
-        user.is_online = False
-        user.save()
+    from profiles.presence import mark_offline
+    if user is not None:
+        mark_offline(user.id)
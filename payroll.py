@@ -0,0 +1,327 @@
+import calendar
+import datetime
+
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from profiles.models import EmployeeIncomeLedger, EmployeeProfile, EmployeeSalary
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+PAYROLL_REPORT_FIELDS = (
+    ('employee_id', 'id'),
+    ('company_id', 'company_id'),
+    ('last_name', 'user__last_name'),
+    ('first_name', 'user__first_name'),
+    ('salary_type', 'salary__type'),
+    ('salary', 'salary__salary'),
+    ('percentage_of_income', 'salary__percentage_of_income'),
+)
+
+PAYROLL_REPORT_COLUMNS = tuple(name for name, _ in PAYROLL_REPORT_FIELDS) + (
+    'income', 'working_days', 'employee_salary',
+)
+
+
+class PeriodError(ValueError):
+    '''
+    Invalid period bound; `bound` is 'date_from' or 'date_to'.
+    '''
+
+    def __init__(self, bound, message):
+        super().__init__(message)
+        self.bound = bound
+        self.message = message
+
+
+def parse_period(date_from, date_to):
+    '''
+    Parses the optional YYYY-MM-DD bounds of a period, shared by the API
+    and the management commands. Missing bounds stay None; raises
+    PeriodError for a malformed date or date_from after date_to.
+    '''
+    period = []
+    for bound, value in (('date_from', date_from), ('date_to', date_to)):
+        parsed = None
+        if value is not None:
+            try:
+                parsed = parse_date(value)
+            except ValueError:
+                pass
+            if parsed is None:
+                raise PeriodError(bound, 'Неверный формат даты, ожидается YYYY-MM-DD')
+        period.append(parsed)
+    if None not in period and period[0] > period[1]:
+        raise PeriodError('date_to', 'Дата окончания периода раньше даты начала')
+    return tuple(period)
+
+
+def get_period(date_from=None, date_to=None):
+    '''
+    Returns the (date_from, date_to) payroll period, both inclusive.
+    Missing bounds default to the first/last day of the current month.
+    '''
+    today = timezone.localdate()
+    if date_from is None:
+        date_from = (date_to or today).replace(day=1)
+    if date_to is None:
+        last_day = calendar.monthrange(date_from.year, date_from.month)[1]
+        date_to = date_from.replace(day=last_day)
+    return date_from, date_to
+
+
+def months_in_period(date_from, date_to):
+    '''
+    Returns the length of the period in months, counting a partial month
+    as the share of its days that fall into the period: a whole calendar
+    month is 1, March 1-15 is 15/31.
+    '''
+    months = 0
+    day = date_from
+    while day <= date_to:
+        last_day = day.replace(day=calendar.monthrange(day.year, day.month)[1])
+        end = min(last_day, date_to)
+        months += ((end - day).days + 1) / last_day.day
+        day = end + datetime.timedelta(days=1)
+    return months
+
+
+def weekday_counts(date_from, date_to):
+    '''
+    Returns a dict {day_of_the_week: occurrences} for the period,
+    where day_of_the_week follows WorkDay.DAYS_OF_THE_WEEK (1 = ПН).
+    '''
+    counts = dict.fromkeys(range(1, 8), 0)
+    total_days = (date_to - date_from).days + 1
+    if total_days <= 0:
+        return counts
+    full_weeks, rest = divmod(total_days, 7)
+    for day in counts:
+        counts[day] = full_weeks
+    for offset in range(rest):
+        counts[(date_from + datetime.timedelta(days=offset)).isoweekday()] += 1
+    return counts
+
+
+def _schedule_weekdays(employee_ids):
+    '''
+    Returns {employee_id: set(day_of_the_week)} of working days for the
+    given employees, read from the work_schedule through table in one query.
+    '''
+    through = EmployeeProfile.work_schedule.through
+    rows = through.objects.filter(
+        employeeprofile_id__in=employee_ids,
+        workday__day_type=1,
+        workday__working_hours__gt=0,
+    ).values_list('employeeprofile_id', 'workday__day_of_the_week')
+
+    result = {employee_id: set() for employee_id in employee_ids}
+    for employee_id, day in rows:
+        result[employee_id].add(day)
+    return result
+
+
+def calculate_salary(salary_type, salary, percentage, income, working_days, months):
+    salary = salary or 0
+    percentage = percentage or 0
+    income = income or 0
+
+    amount = (float(income) / 100) * percentage
+    if salary_type == 1:
+        amount += salary * working_days
+    else:
+        amount += salary * months
+    return amount
+
+
+def _build_payroll(employee_id, salary, income, weekdays, counts, months):
+    salary_type = getattr(salary, 'type', None)
+    salary_value = getattr(salary, 'salary', None)
+    percentage = getattr(salary, 'percentage_of_income', None)
+    working_days = sum(counts[day] for day in weekdays)
+    return {
+        'employee_id': employee_id,
+        'salary_type': salary_type,
+        'salary': salary_value,
+        'percentage_of_income': percentage,
+        'income': float(income or 0),
+        'working_days': working_days,
+        'employee_salary': calculate_salary(
+            salary_type, salary_value, percentage, income, working_days, months
+        ),
+    }
+
+
+def employee_payroll(employee, date_from=None, date_to=None):
+    '''
+    Computes the payroll of a single employee for the period.
+    The income of the period is summed over the daily income ledger,
+    so the cost depends on the number of days rather than events.
+    '''
+    date_from, date_to = get_period(date_from, date_to)
+
+    income = EmployeeIncomeLedger.objects.filter(
+        employee=employee,
+        company_id=employee.company_id,
+        date__range=(date_from, date_to),
+    ).aggregate(income=Sum('income'))['income']
+
+    try:
+        salary = employee.salary
+    except EmployeeSalary.DoesNotExist:
+        salary = None
+
+    weekdays = _schedule_weekdays([employee.id])[employee.id]
+    return _build_payroll(
+        employee.id, salary, income, weekdays,
+        weekday_counts(date_from, date_to),
+        months_in_period(date_from, date_to)
+    )
+
+
+def company_payroll(company_ids, date_from=None, date_to=None):
+    '''
+    Computes the payroll of every employee of the given companies.
+    Employees, salaries and incomes are read with a single annotated query,
+    work schedules with one more.
+    '''
+    date_from, date_to = get_period(date_from, date_to)
+
+    employees = list(
+        EmployeeProfile.objects
+        .filter(company_id__in=company_ids)
+        .select_related('salary')
+        .annotate(income=Sum(
+            'income_ledger__income',
+            filter=Q(
+                income_ledger__company=F('company'),
+                income_ledger__date__range=(date_from, date_to)
+            )
+        ))
+        .order_by('id')
+    )
+
+    schedules = _schedule_weekdays([employee.id for employee in employees])
+    counts = weekday_counts(date_from, date_to)
+    months = months_in_period(date_from, date_to)
+
+    result = []
+    for employee in employees:
+        try:
+            salary = employee.salary
+        except EmployeeSalary.DoesNotExist:
+            salary = None
+        result.append(_build_payroll(
+            employee.id, salary, employee.income, schedules[employee.id], counts, months
+        ))
+    return result
+
+
+def payroll_columns(company_ids, date_from, date_to):
+    '''
+    Reads the payroll inputs of the companies' employees as columns
+    ({name: list}, aligned and ordered by employee id) plus the
+    (employee_id, day_of_the_week) pairs of their working days, with three
+    queries: employees with salaries, ledger income, work schedules.
+    '''
+    names = [name for name, _ in PAYROLL_REPORT_FIELDS]
+    rows = (
+        EmployeeProfile.objects
+        .filter(company_id__in=company_ids)
+        .order_by('id')
+        .values_list(*[lookup for _, lookup in PAYROLL_REPORT_FIELDS])
+    )
+    columns = dict(zip(names, [list(values) for values in zip(*rows)] or [[] for _ in names]))
+
+    income = dict(
+        EmployeeIncomeLedger.objects
+        .filter(
+            company_id__in=company_ids,
+            company_id=F('employee__company_id'),
+            date__range=(date_from, date_to),
+        )
+        .values('employee_id')
+        .annotate(income=Sum('income'))
+        .order_by()
+        .values_list('employee_id', 'income')
+    )
+    columns['income'] = [float(income.get(employee_id) or 0) for employee_id in columns['employee_id']]
+
+    through = EmployeeProfile.work_schedule.through
+    schedule = list(
+        through.objects
+        .filter(
+            employeeprofile__company_id__in=company_ids,
+            workday__day_type=1,
+            workday__working_hours__gt=0,
+        )
+        .values_list('employeeprofile_id', 'workday__day_of_the_week')
+        .distinct()
+    )
+    return columns, schedule
+
+
+def _compute_payroll_numpy(columns, schedule, counts, months):
+    employee_ids = numpy.asarray(columns['employee_id'], dtype=numpy.int64)
+    day_counts = numpy.array([0] + [counts[day] for day in range(1, 8)], dtype=numpy.float64)
+    if schedule:
+        schedule_employees, schedule_days = numpy.asarray(schedule, dtype=numpy.int64).T
+        # employee ids are sorted, so searchsorted maps them to row positions
+        positions = numpy.searchsorted(employee_ids, schedule_employees)
+        working_days = numpy.bincount(positions, weights=day_counts[schedule_days], minlength=len(employee_ids))
+    else:
+        working_days = numpy.zeros(len(employee_ids))
+
+    # missing salaries come as None -> nan -> 0
+    salary_type = numpy.asarray(columns['salary_type'], dtype=numpy.float64)
+    salary = numpy.nan_to_num(numpy.asarray(columns['salary'], dtype=numpy.float64))
+    percentage = numpy.nan_to_num(numpy.asarray(columns['percentage_of_income'], dtype=numpy.float64))
+    income = numpy.asarray(columns['income'], dtype=numpy.float64)
+
+    amount = (income / 100) * percentage + numpy.where(salary_type == 1, salary * working_days, salary * months)
+    return working_days.astype(numpy.int64).tolist(), amount.tolist()
+
+
+def _compute_payroll_python(columns, schedule, counts, months):
+    days = {}
+    for employee_id, day in schedule:
+        days[employee_id] = days.get(employee_id, 0) + counts[day]
+    working_days = [days.get(employee_id, 0) for employee_id in columns['employee_id']]
+    amount = [
+        calculate_salary(*values, months)
+        for values in zip(
+            columns['salary_type'], columns['salary'], columns['percentage_of_income'],
+            columns['income'], working_days
+        )
+    ]
+    return working_days, amount
+
+
+def compute_payroll(columns, schedule, counts, months):
+    '''
+    Adds the working_days and employee_salary columns, with the same
+    arithmetic as calculate_salary(), vectorized when NumPy is installed.
+    '''
+    if not columns['employee_id']:
+        columns['working_days'], columns['employee_salary'] = [], []
+    elif numpy is not None:
+        columns['working_days'], columns['employee_salary'] = _compute_payroll_numpy(columns, schedule, counts, months)
+    else:
+        columns['working_days'], columns['employee_salary'] = _compute_payroll_python(columns, schedule, counts, months)
+    return columns
+
+
+def payroll_report(company_ids, date_from=None, date_to=None):
+    '''
+    Returns (column names, row iterator) of the payroll of every employee of
+    the companies for the period, for render_csv() / render_ndjson().
+    '''
+    date_from, date_to = get_period(date_from, date_to)
+    columns, schedule = payroll_columns(company_ids, date_from, date_to)
+    compute_payroll(columns, schedule, weekday_counts(date_from, date_to), months_in_period(date_from, date_to))
+    return PAYROLL_REPORT_COLUMNS, zip(*[columns[name] for name in PAYROLL_REPORT_COLUMNS])
@@ -1,32 +1,35 @@
 import rest_framework
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
+from profiles.authorization import get_authorization_context
+
 
 class IsAdminOrReadOnly(BasePermission):
     def has_permission(self, request, view):
         return bool(
-            request.user.is_superuser or 
+            get_authorization_context(request).is_superuser or 
             request.method in SAFE_METHODS
         )
 
 
 class IsManager(BasePermission):
     def has_permission(self, request, view):
-        return request.user.user_type == 1
+        return get_authorization_context(request).is_manager
 
 
 class IsManagerOrReadOnly(BasePermission):
     def has_permission(self, request, view):
         return bool(
-            request.user.user_type == 1 or
+            get_authorization_context(request).is_manager or
             request.method in SAFE_METHODS
         )
 
 
 class IsManagerOrAdminOrReadOnly(BasePermission):
     def has_permission(self, request, view):
+        context = get_authorization_context(request)
         return bool(
-            request.user.is_staff or
-            request.user.user_type == 1 or
+            context.is_staff or
+            context.is_manager or
             request.method in SAFE_METHODS
         )
@@ -0,0 +1,108 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from profiles.models import User
+from profiles.scoping import company_user_ids
+
+
+# Cache alias holding presence keys; any backend works, locmem is used in tests.
+PRESENCE_CACHE = getattr(settings, 'PROFILES_PRESENCE_CACHE', 'default')
+# Seconds after the last mark_online() before a user counts as offline.
+PRESENCE_TTL = getattr(settings, 'PROFILES_PRESENCE_TTL', 60 * 15)
+# Seconds between two refreshes of a user's presence by the same process.
+PRESENCE_TOUCH_INTERVAL = getattr(settings, 'PROFILES_PRESENCE_TOUCH_INTERVAL', 60)
+PRESENCE_TOUCH_MAX_USERS = 10000
+
+_touched = {}
+
+
+def _cache():
+    return caches[PRESENCE_CACHE]
+
+
+def presence_key(user_id):
+    return 'profiles:presence:%s' % user_id
+
+
+def mark_online(user_id):
+    _cache().set(presence_key(user_id), True, PRESENCE_TTL)
+
+
+def mark_offline(user_id):
+    user_id = int(user_id)
+    _touched.pop(user_id, None)
+    _cache().delete(presence_key(user_id))
+
+
+def _touch_due(user_id):
+    # token claims carry the id as a string, User objects as an int
+    user_id = int(user_id)
+    now = time.monotonic()
+    touched = _touched.get(user_id)
+    if touched is not None and now - touched < PRESENCE_TOUCH_INTERVAL:
+        return False
+    if len(_touched) >= PRESENCE_TOUCH_MAX_USERS:
+        _touched.clear()
+    _touched[user_id] = now
+    return True
+
+
+def touch_presence(user_id):
+    '''
+    Keeps the user online while it makes authenticated requests. The cache
+    is written at most once per PRESENCE_TOUCH_INTERVAL per process.
+    '''
+    user_id = int(user_id)
+    if _touch_due(user_id):
+        mark_online(user_id)
+
+
+async def atouch_presence(user_id):
+    user_id = int(user_id)
+    if _touch_due(user_id):
+        await _cache().aset(presence_key(user_id), True, PRESENCE_TTL)
+
+
+def online_user_ids(user_ids):
+    '''
+    Returns the subset of user_ids that are online, with one cache round trip.
+    '''
+    keys = {presence_key(user_id): user_id for user_id in user_ids}
+    return {keys[key] for key in _cache().get_many(list(keys))}
+
+
+def online_in_company(company_id):
+    '''
+    Returns the sorted IDs of the company's staff (managers, sub-managers
+    and employees) that are online: one query plus one cache round trip.
+    '''
+    return sorted(online_user_ids(company_user_ids(company_id)))
+
+
+def flush_presence(batch_size=1000):
+    '''
+    Writes the cached presence back to User.is_online with at most two
+    UPDATE statements per batch, touching only rows whose value changed.
+    Returns the number of updated rows.
+    '''
+    updated = 0
+    batch = []
+    user_ids = User.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+    for user_id in user_ids:
+        batch.append(user_id)
+        if len(batch) >= batch_size:
+            updated += _flush_batch(batch)
+            batch = []
+    if batch:
+        updated += _flush_batch(batch)
+    return updated
+
+
+def _flush_batch(user_ids):
+    online = online_user_ids(user_ids)
+    offline = set(user_ids) - online
+    updated = User.objects.filter(id__in=online, is_online=False).update(is_online=True)
+    updated += User.objects.filter(id__in=offline, is_online=True).update(is_online=False)
+    return updated
@@ -0,0 +1,40 @@
+from django.db.models import Count, Sum
+
+from profiles.models import EmployeeCapacity
+
+
+def working_on(company_ids, day_of_the_week, category_id=None):
+    '''
+    Returns the capacity rows (employee_id, category_id, working_hours) of
+    the employees working on the given day of the week, ordered by employee.
+    '''
+    capacity = EmployeeCapacity.objects.filter(company_id__in=company_ids, day_of_the_week=day_of_the_week)
+    if category_id is not None:
+        capacity = capacity.filter(category_id=category_id)
+    return capacity.order_by('employee_id').values('employee_id', 'category_id', 'working_hours')
+
+
+def weekly_capacity(company_ids, category_id=None):
+    '''
+    Returns the scheduled hours and the number of working employees
+    per category and day of the week: a list of dicts ordered by category and day.
+    '''
+    capacity = EmployeeCapacity.objects.filter(company_id__in=company_ids)
+    if category_id is not None:
+        capacity = capacity.filter(category_id=category_id)
+    return list(
+        capacity
+        .values('category_id', 'day_of_the_week')
+        .annotate(hours=Sum('working_hours'), employees=Count('employee_id'))
+        .order_by('category_id', 'day_of_the_week')
+    )
+
+
+def category_hours(rows):
+    '''
+    Sums weekly_capacity() rows into [{'category_id', 'hours'}] per category.
+    '''
+    totals = {}
+    for row in rows:
+        totals[row['category_id']] = totals.get(row['category_id'], 0) + row['hours']
+    return [{'category_id': category_id, 'hours': hours} for category_id, hours in totals.items()]
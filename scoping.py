@@ -0,0 +1,143 @@
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+
+COMPANY_SCOPE_TIMEOUT = 60 * 5
+
+# Company relation to filter on for each User.user_type
+COMPANY_LOOKUPS = {
+    1: 'managers__user_id',
+    2: 'sub_managers__user_id',
+    3: 'employees__user_id',
+}
+
+
+def company_scope_cache_key(user_id):
+    return 'profiles:company_scope:%s' % user_id
+
+
+def _base_request(request):
+    # DRF's Request proxies the Django HttpRequest; memoize on the latter so
+    # permission classes, views and function decorators share one value.
+    return getattr(request, '_request', request)
+
+
+def resolve_company_ids(user_id, user_type):
+    '''
+    Returns the sorted IDs of the companies the user belongs to in its role:
+    managed companies for managers and sub-managers, the employer for employees.
+    '''
+    lookup = COMPANY_LOOKUPS.get(user_type)
+    if lookup is None:
+        return []
+    Company = apps.get_model('company', 'Company')
+    return sorted(Company.objects.filter(**{lookup: user_id}).values_list('id', flat=True).distinct())
+
+
+def get_company_ids(request):
+    '''
+    Returns the list of company IDs managed by the request's user.
+    Tokens carrying a company_ids claim are used as is; otherwise the value
+    is computed once per request and cached across requests until the
+    manager's company membership changes.
+    '''
+    base = _base_request(request)
+    company_ids = getattr(base, '_profiles_company_ids', None)
+    if company_ids is not None:
+        return company_ids
+
+    user = request.user
+    company_ids = getattr(user, 'company_ids', None)
+    if company_ids is None or user.user_type != 1:
+        key = company_scope_cache_key(user.id)
+        company_ids = cache.get(key)
+        if company_ids is None:
+            company_ids = resolve_company_ids(user.id, 1)
+            cache.set(key, company_ids, COMPANY_SCOPE_TIMEOUT)
+
+    base._profiles_company_ids = company_ids
+    return company_ids
+
+
+def invalidate_company_scope(user_ids):
+    cache.delete_many([company_scope_cache_key(user_id) for user_id in user_ids])
+
+
+def company_user_ids(company_id):
+    '''
+    Returns the IDs of the company's staff users (managers, sub-managers and
+    employees) with a single UNION query.
+    '''
+    employees = apps.get_model('profiles', 'EmployeeProfile').objects.filter(company_id=company_id)
+    managers = apps.get_model('profiles', 'ManagerProfile').objects.filter(company=company_id)
+    sub_managers = apps.get_model('profiles', 'SubManagerProfile').objects.filter(company=company_id)
+    return set(
+        employees.values_list('user_id', flat=True).union(
+            managers.values_list('user_id', flat=True),
+            sub_managers.values_list('user_id', flat=True),
+        )
+    )
+
+
+def scope_version_key(user_id):
+    return 'profiles:scope_version:%s' % user_id
+
+
+def _stored_scope_version(row):
+    # no user: 0, so that no token matches; user without a UserScope row: 1
+    if row is None:
+        return 0
+    return row[1] or 1
+
+
+def _scope_version_row(user_id):
+    User = apps.get_model('profiles', 'User')
+    return User.objects.filter(pk=user_id).values_list('id', 'scope__version')
+
+
+def get_scope_version(user_id):
+    '''
+    Returns the user's scope version. The value is stored in UserScope and
+    cached for COMPANY_SCOPE_TIMEOUT, so a lost or evicted cache key never
+    brings the claims of revoked tokens back.
+    '''
+    key = scope_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = _stored_scope_version(_scope_version_row(user_id).first())
+        cache.set(key, version, COMPANY_SCOPE_TIMEOUT)
+    return version
+
+
+async def aget_scope_version(user_id):
+    key = scope_version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        version = _stored_scope_version(await _scope_version_row(user_id).afirst())
+        await cache.aset(key, version, COMPANY_SCOPE_TIMEOUT)
+    return version
+
+
+def bump_scope_versions(user_ids):
+    '''
+    Invalidates the claims of tokens already issued to the users:
+    their scope_version no longer matches and they have to be refreshed.
+    The cached value is dropped now and again after commit, so it is not
+    re-read from an uncommitted row. With a per-process cache other
+    processes see the change after COMPANY_SCOPE_TIMEOUT at the latest.
+    '''
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    UserScope = apps.get_model('profiles', 'UserScope')
+    User = apps.get_model('profiles', 'User')
+    existing_user_ids = User.objects.filter(pk__in=user_ids).values_list('id', flat=True)
+    UserScope.objects.bulk_create(
+        [UserScope(user_id=user_id) for user_id in existing_user_ids], ignore_conflicts=True
+    )
+    UserScope.objects.filter(user_id__in=user_ids).update(version=F('version') + 1)
+    keys = [scope_version_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,185 @@
+import logging
+import re
+
+from django.db import DatabaseError, OperationalError, connections, transaction
+from django.db.models.expressions import RawSQL
+
+from profiles.models import CustomerProfile, EmployeeProfile
+
+
+logger = logging.getLogger('profiles.search')
+
+SEARCH_MODELS = (EmployeeProfile, CustomerProfile)
+
+# User fields copied into the profiles' search_text column
+USER_SEARCH_FIELDS = ('last_name', 'first_name', 'middle_name', 'phone')
+
+# FTS5's trigram tokenizer can only match terms of at least three characters
+FTS_MIN_TERM_LENGTH = 3
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+# (database alias, table) pairs known to have an FTS5 index
+_fts_tables = set()
+
+
+def normalize(text):
+    '''
+    Case-folds the text (Cyrillic included), folds ё into е and
+    collapses punctuation and whitespace into single spaces.
+    '''
+    text = (text or '').casefold().replace('ё', 'е')
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def build_search_text(user, address=''):
+    values = [getattr(user, field) or '' for field in USER_SEARCH_FIELDS]
+    phone_digits = re.sub(r'\D', '', user.phone or '')
+    return normalize(' '.join(values + [phone_digits, address or '']))
+
+
+def profile_search_text(profile):
+    return build_search_text(profile.user, getattr(profile, 'address', ''))
+
+
+def _fts_table(model):
+    return '%s_fts' % model._meta.db_table
+
+
+def _fts_available(connection, model):
+    key = (connection.alias, _fts_table(model))
+    if key in _fts_tables:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [key[1]])
+        if cursor.fetchone() is None:
+            return False
+    _fts_tables.add(key)
+    return True
+
+
+def _install_trigram_indexes(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            # needs a role allowed to create extensions
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # outside a transaction the index is built without locking writes
+        concurrently = '' if connection.in_atomic_block else 'CONCURRENTLY '
+        for model in SEARCH_MODELS:
+            table = model._meta.db_table
+            cursor.execute(
+                'CREATE INDEX {concurrently}IF NOT EXISTS {table}_search_trgm ON {table} '
+                'USING gin (search_text gin_trgm_ops)'.format(concurrently=concurrently, table=table)
+            )
+
+
+def install_search_indexes(using='default', fail_silently=False):
+    '''
+    Creates the n-gram index over search_text: a pg_trgm GIN index on
+    PostgreSQL, an FTS5 trigram table kept in sync by triggers on SQLite.
+    Safe to call repeatedly. With fail_silently a database error (e.g. a
+    role not allowed to create the extension) is logged and False returned;
+    search then works without the index.
+    '''
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        try:
+            if connection.in_atomic_block:
+                with transaction.atomic(using=using):
+                    _install_trigram_indexes(connection)
+            else:
+                _install_trigram_indexes(connection)
+        except DatabaseError:
+            if not fail_silently:
+                raise
+            logger.warning(
+                'Could not create the profiles search index on %r; run rebuild_search_index '
+                'as a role allowed to create the pg_trgm extension', using, exc_info=True
+            )
+            return False
+    elif connection.vendor == 'sqlite':
+        for model in SEARCH_MODELS:
+            if _fts_available(connection, model):
+                continue
+            table = model._meta.db_table
+            fts = _fts_table(model)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "CREATE VIRTUAL TABLE {fts} USING fts5(search_text, content='{table}', "
+                        "content_rowid='id', tokenize='trigram')".format(fts=fts, table=table)
+                    )
+            except OperationalError:
+                # SQLite without FTS5 or the trigram tokenizer: search falls back to LIKE
+                return False
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN '
+                    'INSERT INTO {fts}(rowid, search_text) VALUES (new.id, new.search_text); END'
+                    .format(fts=fts, table=table)
+                )
+                cursor.execute(
+                    'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN '
+                    "INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+                    .format(fts=fts, table=table)
+                )
+                cursor.execute(
+                    'CREATE TRIGGER {fts}_au AFTER UPDATE OF search_text ON {table} BEGIN '
+                    "INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+                    'INSERT INTO {fts}(rowid, search_text) VALUES (new.id, new.search_text); END'
+                    .format(fts=fts, table=table)
+                )
+                cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=fts))
+    else:
+        return False
+    return True
+
+
+def search_profiles(model, company_ids, query):
+    '''
+    Returns the queryset of profiles whose search_text contains every term
+    of the query, in any order, limited to company_ids unless it is None.
+    '''
+    queryset = model.objects.all()
+    if company_ids is not None:
+        queryset = queryset.filter(company_id__in=company_ids)
+    terms = normalize(query).split()
+    if not terms:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+    use_fts = (
+        connection.vendor == 'sqlite'
+        and all(len(term) >= FTS_MIN_TERM_LENGTH for term in terms)
+        and _fts_available(connection, model)
+    )
+    if use_fts:
+        fts = _fts_table(model)
+        match = ' '.join('"%s"' % term for term in terms)
+        return queryset.filter(
+            id__in=RawSQL('SELECT rowid FROM {fts} WHERE {fts} MATCH %s'.format(fts=fts), [match])
+        )
+
+    for term in terms:
+        queryset = queryset.filter(search_text__contains=term)
+    return queryset
+
+
+def rebuild_search_text(batch_size=1000):
+    '''
+    Recomputes search_text of every profile. Returns the number of rows updated.
+    '''
+    updated = 0
+    for model in SEARCH_MODELS:
+        batch = []
+        for profile in model.objects.select_related('user').order_by('id').iterator(chunk_size=batch_size):
+            profile.search_text = profile_search_text(profile)
+            batch.append(profile)
+            if len(batch) >= batch_size:
+                model.objects.bulk_update(batch, ['search_text'])
+                updated += len(batch)
+                batch = []
+        model.objects.bulk_update(batch, ['search_text'])
+        updated += len(batch)
+    return updated
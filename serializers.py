@@ -1,35 +1,33 @@
-from django.contrib.auth.hashers import make_password
-
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.utils.encoding import smart_str
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
 from company.models import Company
 from events.serializers import EventSerializer
+from profiles.authentication import add_user_claims
+from profiles.avatars import avatar_thumbnails
+from profiles.hashing import hash_password
+from profiles.login import resolve_login_context
+from profiles.presence import mark_online, touch_presence
 from profiles.models import CustomerProfile, User, ManagerProfile, EmployeeProfile, EmployeeCategory, WorkDay
 
 
 class TokenObtainLifetimeSerializer(TokenObtainPairSerializer):
 
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
     def validate(self, attrs):
         data = super().validate(attrs)
-        refresh = self.get_token(self.user)
-        user_type = self.user.user_type
-
-        try:
-            manager = ManagerProfile.objects.get(user_id=self.user.id)
-            company = Company.objects.filter(manager=manager)
-            data['company_id'] = company[0].id
-            data['company_name'] = company[0].name
-        except:
-            try:
-                employee = EmployeeProfile.objects.get(user_id=self.user.id)
-                data['company_id'] = employee.company.id
-                data['company_name'] = employee.company.name
-            except:
-                data['company_id'] = None
-                data['company_name'] = 'Компания'
-        data['lifetime'] = int(refresh.access_token.lifetime.total_seconds())
+        # token logins do not send user_logged_in
+        mark_online(self.user.id)
+        data.update(resolve_login_context(self.user))
+        data['lifetime'] = int(AccessToken.lifetime.total_seconds())
         data['username'] = self.user.username
         data['user_type'] = self.user.user_type
         data['user_id'] = self.user.id
@@ -41,24 +39,39 @@ class TokenRefreshLifetimeSerializer(TokenRefreshSerializer):
     def validate(self, attrs):
         data = super().validate(attrs)
         refresh = RefreshToken(attrs['refresh'])
-        data['lifetime'] = int(refresh.access_token.lifetime.total_seconds())
+        user_id = refresh[jwt_settings.USER_ID_CLAIM]
+        user = User.objects.filter(pk=user_id, is_active=True).only(
+            'id', 'username', 'user_type', 'is_staff', 'is_superuser'
+        ).first()
+        if user is None:
+            raise InvalidToken('Пользователь не найден или неактивен')
+        touch_presence(user.id)
+
+        # re-stamp the access token so changed companies reach the client
+        access = add_user_claims(refresh.access_token, user)
+        data['access'] = str(access)
+        data['lifetime'] = int(access.lifetime.total_seconds())
         return data
 
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ('id', 'first_name', 'last_name', 'username', 'password', 'email', 'phone', 'birthdate', 'avatar', 'gender', 'user_type')
+        fields = ('id', 'first_name', 'last_name', 'username', 'password', 'email', 'phone', 'birthdate', 'avatar', 'avatar_thumbnails', 'gender', 'user_type')
         extra_kwargs = {
             'password': {'write_only': True}
         }
 
+    def get_avatar_thumbnails(self, obj):
+        return avatar_thumbnails(obj.avatar_hash, self.context.get('request'))
+
     def create(self, validated_data):
         password = validated_data.pop('password', None)
         instance = self.Meta.model(**validated_data)
         if password is not None:
-            instance.set_password(password)
+            instance.password = hash_password(password)
         instance.save()
         return instance
 
@@ -69,6 +82,7 @@ class ManagerSerializer(serializers.ModelSerializer):
     class Meta:
         model = ManagerProfile
         fields = ['id', 'user', 'speciality']
+        select_related = ('user',)
 
     def create(self, validated_data):
         user_data = validated_data.pop('user')
@@ -85,6 +99,8 @@ class WorkDaySerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkDay
         fields = ['id', 'day_of_the_week', 'working_hours', 'day_type']
+        # work days are shared values, an existing combination is reused, not rejected
+        validators = []
 
 
 class EmployeeSerializer(serializers.ModelSerializer):
@@ -96,35 +112,77 @@ class EmployeeSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmployeeProfile
         fields = ['id', "user", "category", "company", "work_schedule"]
+        select_related = ('user', 'category', 'company')
+        prefetch_related = ('work_schedule',)
+
+    def validate(self, attrs):
+        category = attrs.get('category', getattr(self.instance, 'category', None))
+        company = attrs.get('company', getattr(self.instance, 'company', None))
+        if category is not None and company is not None and category.company_id != company.id:
+            raise serializers.ValidationError({'category': 'Категория не принадлежит компании'})
+        return attrs
 
     def create(self, validated_data):
         print(validated_data)
         user_data = validated_data.pop('user')
         gender_data = user_data.pop('gender')
         user_type_data = user_data.pop('user_type')
-        work_schedules = validated_data.pop('work_schedule')
-        result_schedule_ids = []
-        user = User.objects.create(password=make_password(user_data.pop('password')), gender=gender_data,
+        work_schedules = validated_data.pop('work_schedule', [])
+        user = User.objects.create(password=hash_password(user_data.pop('password')), gender=gender_data,
                                    user_type=user_type_data, **user_data)
         employee = EmployeeProfile.objects.create(
             user=user,
             **validated_data)
-        for work_schedule in work_schedules:
-            work_day = WorkDay.objects.create(**work_schedule)
-            result_schedule_ids.append(work_day.id)
-
-        for work_day_id in result_schedule_ids:
-            employee.work_schedule.add(work_day_id)
-        instance = employee 
+        work_days = WorkDay.objects.intern_many(work_schedules)
+        if work_days:
+            employee.work_schedule.add(*work_days.values())
+        instance = employee
         return instance
 
 
+class PreloadedSlugRelatedField(serializers.SlugRelatedField):
+    '''
+    SlugRelatedField resolving values from context['preloaded'][field_name],
+    a {str(slug): object} dict read once for a whole batch, instead of one
+    query per value. Without preloaded objects it behaves as usual.
+    '''
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool) or not isinstance(data, (str, int)):
+            self.fail('invalid')
+        try:
+            return preloaded[str(data)]
+        except KeyError:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=smart_str(data))
+
+
+class BulkUserSerializer(UserSerializer):
+
+    class Meta(UserSerializer.Meta):
+        # uniqueness is checked for the whole batch by the view
+        extra_kwargs = dict(UserSerializer.Meta.extra_kwargs, username={'validators': [UnicodeUsernameValidator()]})
+
+
+class EmployeeBulkRowSerializer(EmployeeSerializer):
+    '''
+    EmployeeSerializer for bulk imports: categories and companies come from
+    objects preloaded for the batch and usernames are checked against the
+    table by the view, so validating a row runs no queries.
+    '''
+    user = BulkUserSerializer(required=True)
+    category = PreloadedSlugRelatedField(queryset=EmployeeCategory.objects.all(), slug_field='id')
+    company = PreloadedSlugRelatedField(queryset=Company.objects.all(), slug_field='id')
+
 class EmployeeCategorySerializer(serializers.ModelSerializer):
     company = serializers.SlugRelatedField(queryset=Company.objects.all(), slug_field='id')
 
     class Meta:
         model = EmployeeCategory
         fields = ('id', 'name', 'slug', 'company')
+        select_related = ('company',)
 
 
 class EmployeeEventsSerializer(serializers.ModelSerializer):
@@ -133,6 +191,7 @@ class EmployeeEventsSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmployeeProfile
         fields = ('id', 'user', 'category', 'company', 'events')
+        prefetch_related = ('events',)
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -143,6 +202,7 @@ class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomerProfile
         fields = ('id', 'user', 'creator', 'company', 'address')
+        select_related = ('user', 'creator', 'company')
 
     def create(self, validated_data):
         print(validated_data)
@@ -151,7 +211,7 @@ class CustomerSerializer(serializers.ModelSerializer):
         user_type_data = 4
 
         user = User.objects.create(
-            password=make_password(user_data.pop('password')),
+            password=hash_password(user_data.pop('password')),
             gender=gender_data,
             user_type=user_type_data,
             **user_data
@@ -164,3 +224,30 @@ class CustomerSerializer(serializers.ModelSerializer):
         instance = customer
         
         return instance
+
+
+class CustomerImportRowSerializer(serializers.Serializer):
+    username = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    middle_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    email = serializers.EmailField(required=False, allow_blank=True)
+    phone = serializers.CharField(max_length=20, required=False, allow_blank=True)
+    gender = serializers.ChoiceField(choices=User.GENDER_CHOICES, required=False, allow_null=True)
+    birthdate = serializers.DateField(required=False, allow_null=True)
+    address = serializers.CharField(max_length=255)
+    password = serializers.CharField(required=False, allow_blank=True, write_only=True)
+
+    def to_internal_value(self, data):
+        # CSV rows carry empty strings for missing optional values
+        if isinstance(data, dict):
+            data = {key: value for key, value in data.items() if value not in ('', None)}
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        if not attrs.get('phone') and not attrs.get('email'):
+            raise serializers.ValidationError('Нужен телефон или email')
+        if attrs.get('email'):
+            attrs['email'] = attrs['email'].lower()
+        attrs['username'] = attrs.get('username') or attrs.get('phone') or attrs.get('email')
+        return attrs
@@ -0,0 +1,168 @@
+import datetime
+import random
+
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from profiles.models import (
+    CustomerProfile,
+    EmployeeCapacity,
+    EmployeeCategory,
+    EmployeeIncomeLedger,
+    EmployeeProfile,
+    EmployeeSalary,
+    ManagerProfile,
+    User,
+    WorkDay,
+)
+from profiles.search import build_search_text
+from profiles.versions import ROSTERS, bump_roster_versions
+
+
+BATCH_SIZE = 1000
+
+FIRST_NAMES = ('Александр', 'Мария', 'Дмитрий', 'Анна', 'Сергей', 'Елена', 'Иван', 'Ольга', 'Артём', 'Наталья')
+LAST_NAMES = ('Иванов', 'Смирнова', 'Кузнецов', 'Попова', 'Васильев', 'Петрова', 'Соколов', 'Фёдорова')
+MIDDLE_NAMES = ('Андреевич', 'Сергеевна', 'Игоревич', 'Олеговна', 'Павлович', 'Викторовна')
+STREETS = ('Ленина', 'Пушкина', 'Гагарина', 'Садовая', 'Лесная', 'Школьная')
+CATEGORIES = ('Врач', 'Медсестра', 'Администратор', 'Ассистент')
+
+# (day_of_the_week, working_hours, day_type) schedules handed out to employees
+SCHEDULES = (
+    [(day, 8, 1) for day in range(1, 6)] + [(6, 0, 2), (7, 0, 2)],
+    [(day, 12, 1) for day in (1, 3, 5)] + [(day, 0, 2) for day in (2, 4, 6, 7)],
+    [(day, 6, 1) for day in range(1, 7)] + [(7, 0, 2)],
+)
+
+
+def _only_fields(model, values):
+    # events and services live in other apps; pass only the fields they have
+    names = {field.name for field in model._meta.get_fields()}
+    return {key: value for key, value in values.items() if key in names}
+
+
+def _person(rng, prefix, index):
+    return {
+        'username': '%s%d' % (prefix, index),
+        'first_name': rng.choice(FIRST_NAMES),
+        'last_name': rng.choice(LAST_NAMES),
+        'middle_name': rng.choice(MIDDLE_NAMES),
+        'phone': '+7%010d' % rng.randrange(10 ** 10),
+        'email': '%s%d@example.com' % (prefix, index),
+        'gender': rng.choice((1, 2)),
+    }
+
+
+def generate_company(employees=100, customers=1000, events=1000, services=20, seed=0, days=90):
+    '''
+    Creates a company with a manager, employee categories, employees with
+    salaries and work schedules, customers and events spread over the last
+    `days` days, using bulk inserts. Returns (company, manager user).
+    '''
+    rng = random.Random(seed)
+    Company = apps.get_model('company', 'Company')
+    tag = '%d_%d' % (seed, rng.randrange(10 ** 9))
+
+    with transaction.atomic():
+        company = Company.objects.create(**_only_fields(Company, {'name': 'Клиника %s' % tag}))
+        manager_user = User.objects.create(
+            username='manager_%s' % tag, user_type=1, password=make_password(None)
+        )
+        manager = ManagerProfile.objects.create(user=manager_user)
+        manager.company.add(company)
+
+        categories = [EmployeeCategory(name=name, company=company) for name in CATEGORIES]
+        for category in categories:
+            category.save()
+
+        work_days = WorkDay.objects.intern_many([
+            {'day_of_the_week': day, 'working_hours': hours, 'day_type': day_type}
+            for schedule in SCHEDULES for day, hours, day_type in schedule
+        ])
+
+        users = [
+            User(user_type=3, password=make_password(None), **_person(rng, 'employee_%s_' % tag, index))
+            for index in range(employees)
+        ]
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        staff = [
+            EmployeeProfile(
+                user=user, company=company, category=rng.choice(categories),
+                search_text=build_search_text(user)
+            )
+            for user in users
+        ]
+        EmployeeProfile.objects.bulk_create(staff, batch_size=BATCH_SIZE)
+        EmployeeSalary.objects.bulk_create([
+            EmployeeSalary(
+                employee=employee, type=rng.choice((1, 2)),
+                salary=rng.randrange(1000, 100000), percentage_of_income=rng.randrange(0, 50)
+            )
+            for employee in staff
+        ], batch_size=BATCH_SIZE)
+
+        through = EmployeeProfile.work_schedule.through
+        through.objects.bulk_create([
+            through(employeeprofile_id=employee.id, workday_id=work_days[day].id)
+            for employee in staff for day in rng.choice(SCHEDULES)
+        ], batch_size=BATCH_SIZE)
+        EmployeeCapacity.rebuild(company_ids=[company.id])
+
+        customer_users = [
+            User(user_type=4, password=make_password(None), **_person(rng, 'customer_%s_' % tag, index))
+            for index in range(customers)
+        ]
+        User.objects.bulk_create(customer_users, batch_size=BATCH_SIZE)
+        customer_profiles = []
+        for user in customer_users:
+            address = 'ул. %s, д. %d' % (rng.choice(STREETS), rng.randrange(1, 200))
+            customer_profiles.append(CustomerProfile(
+                user=user, creator=manager, company=company, address=address,
+                search_text=build_search_text(user, address)
+            ))
+        CustomerProfile.objects.bulk_create(customer_profiles, batch_size=BATCH_SIZE)
+
+        if events and staff:
+            _generate_events(rng, company, staff, customer_profiles, events, services, days)
+
+        for roster in ROSTERS:
+            bump_roster_versions(roster, [company.id])
+
+    return company, manager_user
+
+
+def _generate_events(rng, company, staff, customers, count, services, days):
+    Event = apps.get_model('events', 'Event')
+    Service = Event._meta.get_field('service').related_model
+
+    service_objects = [
+        Service(**_only_fields(Service, {
+            'name': 'Услуга %d' % index,
+            'price': rng.randrange(500, 20000),
+            'company': company,
+        }))
+        for index in range(services)
+    ]
+    Service.objects.bulk_create(service_objects)
+
+    now = timezone.now()
+    batch = []
+    for _ in range(count):
+        start = now - datetime.timedelta(days=rng.randrange(days), hours=rng.randrange(8, 20))
+        batch.append(Event(**_only_fields(Event, {
+            'company': company,
+            'employee': rng.choice(staff),
+            'customer': rng.choice(customers) if customers else None,
+            'service': rng.choice(service_objects),
+            'start': start,
+            'end': start + datetime.timedelta(minutes=30),
+        })))
+        if len(batch) >= BATCH_SIZE:
+            Event.objects.bulk_create(batch)
+            batch = []
+    Event.objects.bulk_create(batch)
+
+    # bulk_create skips the signals that maintain the ledger
+    EmployeeIncomeLedger.rebuild(company_ids=[company.id])
@@ -1,3 +1,701 @@
-from django.test import TestCase
+import datetime
+import io
+import json
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.contrib.auth.hashers import check_password
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from company.models import Company
+from events.models import Event
+from profiles import presence, views
+from profiles.authentication import ClaimsJWTAuthentication, ClaimsUser
+from profiles.bulk import import_customers, read_customer_rows
+from profiles.hashing import HASH_POOL_MIN_BATCH, hash_password, hash_passwords
+from profiles.compact import CompactCustomerSerializer, CompactEmployeeSerializer
+from profiles.models import (
+    CustomerProfile,
+    EmployeeCategory,
+    EmployeeIncomeLedger,
+    EmployeeProfile,
+    EmployeeSalary,
+    ManagerProfile,
+    User,
+    WorkDay,
+)
+from profiles.payroll import PeriodError, company_payroll, months_in_period, parse_period, payroll_report
+from profiles.schedule import weekly_capacity, working_on
+from profiles.scoping import get_company_ids
+from profiles.search import _fts_available, search_profiles
+from profiles.serializers import CustomerSerializer, EmployeeSerializer, TokenObtainLifetimeSerializer
+from profiles.synthetic import _only_fields
+
+
+Service = Event._meta.get_field('service').related_model
+
+
+class ProfilesTestCase(TestCase):
+    """
+        Компания с менеджером, категорией и рабочими днями
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Клиника')
+        cls.manager_user = User.objects.create(username='manager', user_type=1)
+        cls.manager = ManagerProfile.objects.create(user=cls.manager_user)
+        cls.manager.company.add(cls.company)
+        cls.category = EmployeeCategory.objects.create(name='Врач', company=cls.company)
+        cls.work_days = [
+            WorkDay.objects.create(day_of_the_week=day, working_hours=8, day_type=1)
+            for day in range(1, 6)
+        ]
+        cls.service = Service.objects.create(**_only_fields(Service, {
+            'name': 'Прием', 'price': 1500, 'company': cls.company,
+        }))
+
+    def create_employees(self, count):
+        start = EmployeeProfile.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(username='employee%d' % i, user_type=3)
+            employee = EmployeeProfile.objects.create(
+                user=user, category=self.category, company=self.company
+            )
+            employee.work_schedule.add(*self.work_days)
+
+    def create_customers(self, count):
+        start = CustomerProfile.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(username='customer%d' % i, user_type=4)
+            CustomerProfile.objects.create(
+                user=user, creator=self.manager, company=self.company, address='Адрес %d' % i
+            )
+
+    def create_event(self, employee, customer=None, service=None, days_ago=0):
+        start = timezone.now() - datetime.timedelta(days=days_ago)
+        return Event.objects.create(**_only_fields(Event, {
+            'company': self.company,
+            'employee': employee,
+            'customer': customer,
+            'service': service or self.service,
+            'start': start,
+            'end': start + datetime.timedelta(minutes=30),
+        }))
+
+
+class ListQueryCountTests(ProfilesTestCase):
+    """
+        Количество запросов списков не должно зависеть от количества строк
+    """
+
+    def count_queries(self, view_class, path):
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=self.manager_user)
+        with CaptureQueriesContext(connection) as context:
+            response = view_class.as_view()(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, view_class, path, create_rows):
+        create_rows(2)
+        self.count_queries(view_class, path)
+        small = self.count_queries(view_class, path)
+        create_rows(10)
+        large = self.count_queries(view_class, path)
+        self.assertEqual(small, large)
+
+    def test_employee_list(self):
+        self.assertConstantQueries(views.EmployeeListView, '/employees/', self.create_employees)
+
+    def create_employees_with_events(self, count):
+        start = EmployeeProfile.objects.count()
+        self.create_employees(count)
+        self.create_customers(1)
+        customer = CustomerProfile.objects.order_by('id').last()
+        for employee in EmployeeProfile.objects.order_by('id')[start:]:
+            for days_ago in range(2):
+                self.create_event(employee, customer, days_ago=days_ago)
+
+    def test_employee_events_list(self):
+        self.assertConstantQueries(
+            views.EmployeeEventsListView, '/employees/events/', self.create_employees_with_events
+        )
+
+    def test_customers_list(self):
+        self.assertConstantQueries(views.CustomersListView, '/customers/', self.create_customers)
+
+
+class CompactSerializerTests(ProfilesTestCase):
+    """
+        Компактные сериализаторы должны отдавать тот же JSON, что и DRF
+    """
+
+    def assertSameOutput(self, serializer_class, compact_class, queryset):
+        request = APIRequestFactory().get('/')
+        context = {'request': request}
+        expected = serializer_class(queryset.order_by('id'), many=True, context=context).data
+        compact = compact_class(context=context)
+        actual = compact.to_representation(compact.project(queryset.order_by('id')))
+        self.assertEqual(json.loads(json.dumps(expected)), json.loads(json.dumps(actual)))
+
+    def test_employees(self):
+        self.create_employees(3)
+        self.assertSameOutput(EmployeeSerializer, CompactEmployeeSerializer, EmployeeProfile.objects.all())
+
+    def test_customers(self):
+        self.create_customers(3)
+        self.assertSameOutput(CustomerSerializer, CompactCustomerSerializer, CustomerProfile.objects.all())
+
+
+class ConditionalRosterTests(ProfilesTestCase):
+    """
+        Списки отвечают 304, пока данные компании не изменились
+    """
+
+    def get(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = APIRequestFactory().get('/customers/', **headers)
+        force_authenticate(request, user=self.manager_user)
+        response = views.CustomersListView.as_view()(request)
+        # a 304 is a plain HttpResponseNotModified without render()
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_not_modified_until_roster_changes(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.get(first['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_customers(1)
+        changed = self.get(first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+
+    def test_login_does_not_change_roster(self):
+        self.create_customers(1)
+        first = self.get()
+        user = CustomerProfile.objects.get().user
+        with self.captureOnCommitCallbacks(execute=True):
+            user.last_login = timezone.now()
+            user.save(update_fields=['last_login'])
+        self.assertEqual(self.get(first['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.first_name = 'Анна'
+            user.save(update_fields=['first_name'])
+        self.assertEqual(self.get(first['ETag']).status_code, 200)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_without_cache(self):
+        self.assertEqual(self.get().status_code, 200)
+
+class CapacityIndexTests(ProfilesTestCase):
+    """
+        Индекс загрузки следует за графиками работы сотрудников
+    """
+
+    def test_follows_work_schedule(self):
+        self.create_employees(2)
+        self.assertEqual(len(working_on([self.company.id], 4)), 2)
+        self.assertEqual(sum(row['hours'] for row in weekly_capacity([self.company.id])), 80)
+
+        employee = EmployeeProfile.objects.order_by('id').first()
+        employee.work_schedule.remove(self.work_days[3])
+        self.assertEqual([row['employee_id'] for row in working_on([self.company.id], 4)],
+                         [EmployeeProfile.objects.order_by('id').last().id])
+
+        monday = self.work_days[0]
+        monday.working_hours = 4
+        monday.save()
+        self.assertEqual(sum(row['hours'] for row in weekly_capacity([self.company.id])), 64)
+
+
+class PayrollReportTests(ProfilesTestCase):
+    """
+        Отчет по зарплатам совпадает с расчетом по сотрудникам
+    """
+
+    def test_matches_company_payroll(self):
+        self.create_employees(3)
+        first, second, _ = EmployeeProfile.objects.order_by('id')
+        EmployeeSalary.objects.create(employee=first, type=1, salary=1000, percentage_of_income=10)
+        EmployeeSalary.objects.create(employee=second, type=2, salary=50000, percentage_of_income=None)
+        day = datetime.date(2024, 3, 5)
+        EmployeeIncomeLedger.objects.create(employee=first, company=self.company, date=day, income=12000)
+        EmployeeIncomeLedger.objects.create(employee=second, company=self.company, date=day, income=3000)
+
+        period = (datetime.date(2024, 3, 1), datetime.date(2024, 3, 31))
+        names, rows = payroll_report([self.company.id], *period)
+        report = [dict(zip(names, row)) for row in rows]
+        expected = company_payroll([self.company.id], *period)
+
+        self.assertEqual(len(report), len(expected))
+        for row, payroll in zip(report, expected):
+            for name, value in payroll.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(row[name], value, msg=name)
+                else:
+                    self.assertEqual(row[name], value, name)
+
+
+    def test_partial_months_are_prorated(self):
+        self.assertEqual(months_in_period(datetime.date(2024, 3, 1), datetime.date(2024, 3, 31)), 1)
+        self.assertAlmostEqual(months_in_period(datetime.date(2024, 3, 1), datetime.date(2024, 3, 15)), 15 / 31)
+        self.assertAlmostEqual(
+            months_in_period(datetime.date(2024, 1, 15), datetime.date(2024, 2, 14)), 17 / 31 + 14 / 29
+        )
+
+    def test_parse_period(self):
+        self.assertEqual(parse_period('2024-03-01', None), (datetime.date(2024, 3, 1), None))
+        for period, bound in ((('2024-02-30', None), 'date_from'), ((None, 'март'), 'date_to'),
+                              (('2024-03-02', '2024-03-01'), 'date_to')):
+            with self.assertRaises(PeriodError) as context:
+                parse_period(*period)
+            self.assertEqual(context.exception.bound, bound)
+
+    def test_reversed_period_rejected(self):
+        self.create_employees(1)
+        employee = EmployeeProfile.objects.get()
+        request = APIRequestFactory().get(
+            '/employees/%d/salary/' % employee.id, {'date_from': '2024-03-31', 'date_to': '2024-03-01'}
+        )
+        force_authenticate(request, user=self.manager_user)
+        response = views.EmployeeSalaryView.as_view()(request, pk=employee.id)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_to', response.data)
+
+        with self.assertRaises(CommandError):
+            call_command(
+                'payroll_report', company_ids=[self.company.id], date_from='2024-03-31', date_to='2024-03-01'
+            )
+
+class CompanyScopeQueryPlanTests(TestCase):
+    """
+        Выборки по компании должны использовать составные индексы компании
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Клиника')
+        cls.category = EmployeeCategory.objects.create(name='Врач', company=cls.company)
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('query plans are checked on SQLite and PostgreSQL only')
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # tiny test tables are always cheaper to scan sequentially
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.explain(queryset)
+        self.assertIn(index_name, plan, plan)
+
+    def test_employees_by_company_and_category(self):
+        self.assertUsesIndex(
+            EmployeeProfile.objects.filter(company_id__in=[self.company.id], category_id=self.category.id),
+            'profiles_emp_company_cat_idx'
+        )
+
+    def test_customers_by_company_ordered_by_id(self):
+        queryset = CustomerProfile.objects.filter(company_id__in=[self.company.id]).order_by('id')
+        if connection.vendor == 'sqlite':
+            # SQLite index entries end with the rowid, so the plain company FK
+            # index already returns rows in id order and may be preferred
+            plan = self.explain(queryset)
+            self.assertRegex(plan, r'USING (COVERING )?INDEX profiles_cust\w*company_id', plan)
+            self.assertNotIn('TEMP B-TREE', plan, plan)
+        else:
+            self.assertUsesIndex(queryset, 'profiles_cust_company_id_idx')
+
+
+class ScopeVersionTests(ProfilesTestCase):
+    """
+        Токены с устаревшими claims отклоняются, в том числе после потери кеша
+    """
+
+    def setUp(self):
+        # the cache outlives the rolled back data of other tests
+        cache.clear()
+
+    def authenticate(self, token):
+        return ClaimsJWTAuthentication().get_user(AccessToken(str(token)))
+
+    def issue_token(self):
+        return TokenObtainLifetimeSerializer.get_token(self.manager_user).access_token
+
+    def test_current_token_scopes_by_claims(self):
+        user = self.authenticate(self.issue_token())
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user.company_ids, [self.company.id])
+
+        request = APIRequestFactory().get('/')
+        request.user = user
+        with self.assertNumQueries(0):
+            self.assertEqual(get_company_ids(request), [self.company.id])
+
+    def test_outdated_token_rejected(self):
+        token = self.issue_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager.company.remove(self.company)
+        with self.assertRaises(InvalidToken):
+            self.authenticate(token)
+        self.assertEqual(self.authenticate(self.issue_token()).company_ids, [])
+
+    def test_outdated_token_rejected_after_cache_loss(self):
+        token = self.issue_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager.company.remove(self.company)
+        cache.clear()
+        with self.assertRaises(InvalidToken):
+            self.authenticate(token)
+
+    def test_stale_user_save_keeps_version(self):
+        token = self.issue_token()
+        stale_user = User.objects.get(pk=self.manager_user.pk)
+        self.manager.company.remove(self.company)
+        stale_user.save()
+        cache.clear()
+        with self.assertRaises(InvalidToken):
+            self.authenticate(token)
+
+
+@override_settings(ROOT_URLCONF='profiles.urls')
+class AsyncEndpointTests(ProfilesTestCase):
+    """
+        Асинхронные маршруты отвечают так же, как синхронные
+    """
+
+    def setUp(self):
+        self.manager_user.set_password('password')
+        self.manager_user.save(update_fields=['password'])
+        self.create_employees(3)
+        self.create_customers(3)
+        self.employee = EmployeeProfile.objects.order_by('id').first()
+        self.refresh = TokenObtainLifetimeSerializer.get_token(self.manager_user)
+        self.auth = {'headers': {'Authorization': 'Bearer %s' % self.refresh.access_token}}
+
+    async def test_requires_token(self):
+        response = await self.async_client.get('/async/employees/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_employees(self):
+        response = await self.async_client.get('/async/employees/', {'page_size': 2}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), 2)
+
+        response = await self.async_client.get(data['next'], **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIsNone(response.json()['next'])
+
+    async def test_employee_detail(self):
+        response = await self.async_client.get('/async/employees/%d/' % self.employee.id, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.employee.id)
+        self.assertEqual(len(response.json()['work_schedule']), len(self.work_days))
+
+        response = await self.async_client.get('/async/employees/0/', **self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_employee_salary(self):
+        response = await self.async_client.get(
+            '/async/employees/%d/salary/' % self.employee.id,
+            {'date_from': '2024-03-01', 'date_to': '2024-03-31'},
+            **self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['employee_id'], self.employee.id)
+        self.assertEqual(response.json()['working_days'], 21)
+
+    async def test_customers(self):
+        response = await self.async_client.get('/async/customers/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+
+    async def test_token(self):
+        response = await self.async_client.post(
+            '/async/token/', {'username': 'manager', 'password': 'password'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+        response = await self.async_client.post(
+            '/async/token/', {'username': 'manager', 'password': 'wrong'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+    async def test_token_refresh(self):
+        response = await self.async_client.post(
+            '/async/token/refresh/', {'refresh': str(self.refresh)}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+
+class PresenceTests(ProfilesTestCase):
+    """
+        Присутствие обновляется запросами с JWT и при выдаче токена
+    """
+
+    def setUp(self):
+        presence._cache().clear()
+        presence._touched.clear()
+        self.create_employees(2)
+
+    def authenticate(self, user):
+        token = TokenObtainLifetimeSerializer.get_token(user).access_token
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION='Bearer %s' % token)
+        return ClaimsJWTAuthentication().authenticate(request)
+
+    def test_authenticated_request_marks_online(self):
+        employee_user = EmployeeProfile.objects.order_by('id').first().user
+        self.assertEqual(presence.online_in_company(self.company.id), [])
+
+        self.authenticate(employee_user)
+        self.assertEqual(presence.online_in_company(self.company.id), [employee_user.id])
+
+        presence.mark_offline(employee_user.id)
+        self.assertEqual(presence.online_in_company(self.company.id), [])
+        self.authenticate(employee_user)
+        self.assertEqual(presence.online_in_company(self.company.id), [employee_user.id])
+
+    def test_refresh_is_throttled(self):
+        self.authenticate(self.manager_user)
+        presence._cache().delete(presence.presence_key(self.manager_user.id))
+        self.authenticate(self.manager_user)
+        self.assertEqual(presence.online_in_company(self.company.id), [])
+
+
+OWN_COMPANY = object()
+
+
+class SearchTests(ProfilesTestCase):
+    """
+        Поиск по ФИО и телефону: регистр и ё не важны, только компании пользователя
+    """
+
+    def setUp(self):
+        self.other_company = Company.objects.create(name='Другая клиника')
+        self.customer = self.create_customer('Фёдоров', 'Пётр', '+7 (900) 123-45-67', self.company)
+        self.create_customer('Иванова', 'Анна', '+7 (900) 765-43-21', self.company)
+        self.other_customer = self.create_customer('Федоров', 'Петр', '+7 (900) 000-00-00', self.other_company)
+
+    def create_customer(self, last_name, first_name, phone, company):
+        user = User.objects.create(
+            username='%s_%s' % (last_name, company.id), user_type=4,
+            last_name=last_name, first_name=first_name, phone=phone
+        )
+        return CustomerProfile.objects.create(user=user, creator=self.manager, company=company)
+
+    def search(self, query, company_ids=OWN_COMPANY):
+        # None is passed through: search_profiles() does not scope then
+        if company_ids is OWN_COMPANY:
+            company_ids = [self.company.id]
+        return search_profiles(CustomerProfile, company_ids, query)
+
+    def test_folds_case_and_yo(self):
+        for query in ('федоров', 'ФЁДОРОВ', 'Петр Федоров', 'пётр, фёдоров'):
+            self.assertEqual(list(self.search(query)), [self.customer], query)
+
+    def test_phone_digits(self):
+        self.assertEqual(list(self.search('9001234567')), [self.customer])
+
+    def test_fts_index(self):
+        if connection.vendor != 'sqlite' or not _fts_available(connection, CustomerProfile):
+            self.skipTest('the FTS5 index is used on SQLite with the trigram tokenizer only')
+        queryset = self.search('фёдор')
+        self.assertIn('MATCH', str(queryset.query))
+        self.assertEqual(list(queryset), [self.customer])
+
+    def test_short_terms_fall_back_to_like(self):
+        queryset = self.search('пе')
+        self.assertNotIn('MATCH', str(queryset.query))
+        self.assertEqual(list(queryset), [self.customer])
+
+    def test_company_scope(self):
+        self.assertEqual(list(self.search('федоров')), [self.customer])
+        self.assertEqual(list(self.search('федоров', [self.other_company.id])), [self.other_customer])
+        self.assertEqual(set(self.search('федоров', None)), {self.customer, self.other_customer})
+        self.assertEqual(list(self.search('федоров', [])), [])
+
+
+class EmployeeBulkImportTests(ProfilesTestCase):
+    """
+        Пакетный импорт сотрудников: ошибки по строкам и число запросов
+    """
+
+    def row(self, username, **kwargs):
+        row = {
+            'user': {'username': username, 'password': 'password', 'user_type': 3},
+            'category': self.category.id,
+            'company': self.company.id,
+        }
+        row.update(kwargs)
+        return row
+
+    def post(self, rows):
+        request = APIRequestFactory().post('/employees/import/', rows, format='json')
+        force_authenticate(request, user=self.manager_user)
+        with CaptureQueriesContext(connection) as context:
+            response = views.EmployeeBulkImportView.as_view()(request)
+        return response, len(context.captured_queries)
+
+    def test_reports_errors_by_row(self):
+        other_company = Company.objects.create(name='Другая клиника')
+        other_category = EmployeeCategory.objects.create(name='Врач', company=other_company)
+        response, _ = self.post([
+            self.row('new1'),
+            self.row('new1'),
+            self.row('manager'),
+            self.row('new2', category=0),
+            self.row('new3', category=other_category.id, company=other_company.id),
+            self.row('new4', category=other_category.id),
+            self.row('new5'),
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3, 4, 5])
+        self.assertEqual(
+            set(EmployeeProfile.objects.filter(id__in=response.data['created']).values_list('user__username', flat=True)),
+            {'new1', 'new5'}
+        )
+
+    def test_nothing_valid(self):
+        response, _ = self.post([self.row('manager')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], [])
+
+    def test_validation_queries_do_not_grow_with_rows(self):
+        _, small = self.post([self.row('small%d' % i) for i in range(2)])
+        _, large = self.post([self.row('large%d' % i) for i in range(6)])
+        self.assertEqual(small, large)
+
+
+class CustomerImportTests(ProfilesTestCase):
+    """
+        Импорт клиентов: поиск существующих по телефону и email, ошибки по строкам
+    """
+
+    def import_rows(self, rows, **kwargs):
+        return import_customers(rows, self.company.id, self.manager.id, **kwargs)
+
+    def test_matches_email_case_insensitively(self):
+        user = User.objects.create(username='anna', user_type=4, email='Anna.Petrova@Example.com')
+        CustomerProfile.objects.create(user=user, creator=self.manager, company=self.company, address='Адрес')
+
+        stats = self.import_rows([{'email': 'anna.petrova@EXAMPLE.com', 'address': 'Новый адрес'}])
+        self.assertEqual((stats['created'], stats['skipped']), (0, 1))
+
+        stats = self.import_rows(
+            [{'email': 'ANNA.PETROVA@example.com', 'address': 'Новый адрес'}], update_existing=True
+        )
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(CustomerProfile.objects.get().address, 'Новый адрес')
+
+    def test_duplicates_within_file_are_skipped(self):
+        stats = self.import_rows([
+            {'phone': '+79000000001', 'address': 'Адрес 1'},
+            {'phone': '+79000000001', 'address': 'Адрес 2'},
+            {'email': 'a@example.com', 'address': 'Адрес 3'},
+            {'email': 'A@Example.com', 'address': 'Адрес 4'},
+        ])
+        self.assertEqual((stats['created'], stats['skipped']), (2, 2))
+
+    def test_malformed_ndjson_line_is_a_row_error(self):
+        stream = io.BytesIO('\n'.join([
+            json.dumps({'phone': '+79000000001', 'address': 'Адрес 1'}),
+            '{"phone": "+79000000002", ',
+            json.dumps({'phone': '+79000000003'}),
+            json.dumps({'phone': '+79000000004', 'address': 'Адрес 4'}),
+        ]).encode())
+        stats = self.import_rows(read_customer_rows(stream, 'ndjson'), chunk_size=1)
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual([error['index'] for error in stats['errors']], [1, 2])
+
+
+class IncomeLedgerTests(ProfilesTestCase):
+    """
+        Дневной журнал доходов следует за записями и ценами услуг
+    """
+
+    def setUp(self):
+        self.create_employees(2)
+        self.first, self.second = EmployeeProfile.objects.order_by('id')
+
+    def ledger(self):
+        return {
+            (row.employee_id, row.date): (row.income, row.events_count)
+            for row in EmployeeIncomeLedger.objects.all()
+        }
+
+    def test_follows_events(self):
+        event = self.create_event(self.first)
+        day = EmployeeIncomeLedger.event_day(event)
+        self.create_event(self.first)
+        self.assertEqual(self.ledger(), {(self.first.id, day): (3000, 2)})
+
+        event.start -= datetime.timedelta(days=1)
+        event.end -= datetime.timedelta(days=1)
+        event.save()
+        yesterday = EmployeeIncomeLedger.event_day(event)
+        self.assertEqual(self.ledger(), {(self.first.id, day): (1500, 1), (self.first.id, yesterday): (1500, 1)})
+
+        event.employee = self.second
+        event.save()
+        self.assertEqual(self.ledger(), {(self.first.id, day): (1500, 1), (self.second.id, yesterday): (1500, 1)})
+
+        event.delete()
+        self.assertEqual(self.ledger(), {(self.first.id, day): (1500, 1)})
+
+    def test_follows_service_price(self):
+        event = self.create_event(self.first)
+        self.create_event(self.second, days_ago=3)
+        other_service = Service.objects.create(**_only_fields(Service, {
+            'name': 'Консультация', 'price': 700, 'company': self.company,
+        }))
+        self.create_event(self.second, service=other_service)
+
+        self.service.price = 2000
+        self.service.save()
+        ledger = self.ledger()
+        self.assertEqual(ledger[(self.first.id, EmployeeIncomeLedger.event_day(event))], (2000, 1))
+        self.assertEqual(sorted(ledger.values()), [(700, 1), (2000, 1), (2000, 1)])
+
+
+class PasswordHashingTests(ProfilesTestCase):
+    """
+        Пакетное хеширование паролей и его обновление при входе
+    """
+
+    def test_hashing_result(self):
+        passwords = ['password%d' % i for i in range(HASH_POOL_MIN_BATCH)]
+        for workers in (1, 2):
+            result = hash_passwords(passwords, iterations=1000, workers=workers)
+            self.assertEqual(result.count, len(passwords))
+            self.assertLessEqual(result.workers, workers)
+            self.assertEqual((result.algorithm, result.iterations), ('pbkdf2_sha256', 1000))
+            for password, encoded in zip(passwords, result.hashes):
+                self.assertTrue(encoded.startswith('pbkdf2_sha256$1000$'))
+                self.assertTrue(check_password(password, encoded))
+
+    def test_cheap_hash_upgraded_on_login(self):
+        user = User.objects.create(username='cheap', password=hash_password('password', iterations=1000))
+        self.assertTrue(user.check_password('password'))
+        user.refresh_from_db()
+        self.assertFalse(user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(user.check_password('password'))
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from . import views
+from . import async_views, views
+from .models import CustomerProfile, EmployeeProfile
 
 router = routers.DefaultRouter()
 
@@ -15,14 +16,39 @@ urlpatterns = [
     # employees endpemployees/<int:pk>/oints
     path('employees/', views.EmployeeListView.as_view()),
     path('employees/add/', views.EmployeeAddView.as_view()),
+    path('employees/import/', views.EmployeeBulkImportView.as_view()),
     path('employees/<int:pk>/', views.EmployeeDetailView.as_view()),
     path('employees/<int:pk>/salary/', views.EmployeeSalaryView.as_view()),
+    path('employees/salary/', views.CompanyPayrollView.as_view()),
+    path('employees/salary/report/', views.CompanyPayrollReportView.as_view()),
     path('employees/category/', views.EmployeeCategoryListCreateView.as_view()),
     path('employees/events/', views.EmployeeEventsListView.as_view()),
+    path('employees/available/', views.EmployeeAvailabilityView.as_view()),
+    path('employees/capacity/', views.EmployeeCapacityView.as_view()),
+    path('employees/export/', views.RosterExportView.as_view(roster='employees')),
+    path('employees/search/', views.ProfileSearchView.as_view(
+        model=EmployeeProfile, serializer_class=views.EmployeeSerializer)),
 
     # customers endpoints
     path('customers/', views.CustomersListView.as_view()),
-    path('customers/add/', views.CustomerAddView.as_view())
+    path('customers/add/', views.CustomerAddView.as_view()),
+    path('customers/import/', views.CustomerImportView.as_view()),
+    path('customers/export/', views.RosterExportView.as_view(roster='customers')),
+    path('customers/search/', views.ProfileSearchView.as_view(
+        model=CustomerProfile, serializer_class=views.CustomerSerializer)),
+
+    # presence endpoints
+    path('online/', views.OnlineUsersView.as_view()),
+
+    path('metrics/', views.MetricsView.as_view()),
+
+    # async (ASGI) read endpoints
+    path('async/token/', async_views.AsyncTokenObtainPairView.as_view()),
+    path('async/token/refresh/', async_views.AsyncTokenRefreshView.as_view()),
+    path('async/employees/', async_views.AsyncEmployeeListView.as_view()),
+    path('async/employees/<int:pk>/', async_views.AsyncEmployeeDetailView.as_view()),
+    path('async/employees/<int:pk>/salary/', async_views.AsyncEmployeeSalaryView.as_view()),
+    path('async/customers/', async_views.AsyncCustomersListView.as_view()),
 ]
 
 urlpatterns += router.urls
\ No newline at end of file
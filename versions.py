@@ -0,0 +1,80 @@
+import hashlib
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from profiles.scoping import _base_request, get_company_ids
+
+
+ROSTERS = ('employees', 'categories', 'customers')
+
+
+def roster_version_key(roster, company_id):
+    return 'profiles:roster_version:%s:%s' % (roster, company_id)
+
+
+def _new_version():
+    return (uuid.uuid4().hex, time.time())
+
+
+def get_roster_versions(roster, company_ids):
+    '''
+    Returns {company_id: (version, modified timestamp)} of the roster.
+    Companies without a cached version (new or evicted) get a fresh one.
+    '''
+    keys = {roster_version_key(roster, company_id): company_id for company_id in company_ids}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, company_id in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = _new_version()
+            # another process may have stored one first; a cache that keeps
+            # nothing (DummyCache) gets a fresh version on every request
+            if not cache.add(key, version, None):
+                version = cache.get(key) or version
+        versions[company_id] = version
+    return versions
+
+
+def bump_roster_versions(roster, company_ids):
+    '''
+    Marks the roster of the companies as changed once the current
+    transaction commits, so readers never pair the new version with
+    uncommitted data.
+    '''
+    keys = [roster_version_key(roster, company_id) for company_id in set(company_ids) if company_id is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: _new_version() for key in keys}, None))
+
+
+class ConditionalRosterMixin:
+    '''
+    Mixin for GET views over a company roster: answers with ETag and
+    Last-Modified built from the roster versions of the user's companies,
+    and with 304 Not Modified (without touching the queryset or the
+    serializer) when the client's copy is current.
+    '''
+    roster = None
+
+    def get(self, request, *args, **kwargs):
+        base = _base_request(request)
+        versions = get_roster_versions(self.roster, get_company_ids(request))
+        etag = quote_etag(hashlib.md5(repr((
+            self.roster, request.get_host(), request.get_full_path(), sorted(versions.items())
+        )).encode()).hexdigest())
+        last_modified = max((int(modified) for _, modified in versions.values()), default=None)
+
+        response = get_conditional_response(base, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
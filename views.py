@@ -1,9 +1,12 @@
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenViewBase
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from events.models import Event
 from profiles import serializers
 
 from profiles.serializers import (
@@ -12,6 +15,7 @@ from profiles.serializers import (
     UserSerializer,
     ManagerSerializer, 
     EmployeeSerializer, 
+    EmployeeBulkRowSerializer,
     EmployeeCategorySerializer
 )
 from profiles.models import (
@@ -19,40 +23,56 @@ from profiles.models import (
     User, 
     EmployeeProfile, EmployeeCategory, 
     SubManagerProfile, 
-    ManagerProfile
+    ManagerProfile,
+    WorkDay
 )
-from company.serializers import CompanySerializer
 from company.models import Company
+from company.serializers import CompanySerializer
 
+from profiles.authentication import ClaimsJWTAuthentication
+from profiles.bulk import CUSTOMER_IMPORT_FORMATS, bulk_create_employees, import_customers, read_customer_rows
+from profiles.export import EXPORT_FORMATS, export_rows, render, render_csv
+from profiles.instrumentation import InstrumentedViewMixin, registry
+from profiles.compact import CompactCustomerSerializer, CompactEmployeeSerializer
+from profiles.mixins import CompactListMixin, QuerysetOptimizationMixin
+from profiles.presence import online_in_company
+from profiles.search import search_profiles
+from profiles.pagination import IdCursorPagination
+from profiles.versions import ConditionalRosterMixin
+from profiles.scoping import get_company_ids
+from profiles.schedule import category_hours, weekly_capacity, working_on
+from profiles.payroll import PeriodError, employee_payroll, company_payroll, parse_period, payroll_report
 from profiles.serializers import TokenObtainLifetimeSerializer, TokenRefreshLifetimeSerializer
 from .permissions import IsAdminOrReadOnly, IsManager, IsManagerOrReadOnly
 
 
-class TokenObtainPairView(TokenViewBase):
+class TokenObtainPairView(InstrumentedViewMixin, TokenViewBase):
     """
         Return JWT tokens (access and refresh) for specific user based on username and password.
     """
     serializer_class = TokenObtainLifetimeSerializer
 
 
-class TokenRefreshView(TokenViewBase):
+class TokenRefreshView(InstrumentedViewMixin, TokenViewBase):
     """
         Renew tokens (access and refresh) with new expire time based on specific user's access token.
     """
     serializer_class = TokenRefreshLifetimeSerializer
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
     permission_classes = [IsAuthenticated, IsManager]
+    pagination_class = IdCursorPagination
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
 
-class ManagerViewSet(viewsets.ModelViewSet):
+class ManagerViewSet(InstrumentedViewMixin, QuerysetOptimizationMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsAdminUser]
+    pagination_class = IdCursorPagination
     queryset = ManagerProfile.objects.all()
     serializer_class = ManagerSerializer
 
@@ -66,7 +86,7 @@ class ManagerViewSet(viewsets.ModelViewSet):
             return super().get_queryset().none()
 
 
-class EmployeeAddView(generics.CreateAPIView):
+class EmployeeAddView(InstrumentedViewMixin, generics.CreateAPIView):
     """
         Функция:
             Создает профиль нового сотрудника
@@ -81,21 +101,104 @@ class EmployeeAddView(generics.CreateAPIView):
     queryset = EmployeeProfile.objects.all()
 
 
-class EmployeeListView(generics.ListAPIView):
+class EmployeeBulkImportView(InstrumentedViewMixin, generics.GenericAPIView):
     """
+        method: POST
+        Функция:
+            Создает профили сотрудников из списка одним пакетом
         Возвращает:
-            Список сотрудников компании
+            id созданных сотрудников и ошибки по номерам строк
+    """
+    serializer_class = EmployeeBulkRowSerializer
+    permission_classes = [IsAuthenticated, IsManager]
+    max_rows = 1000
+    preloaded = {}
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['preloaded'] = self.preloaded
+        return context
+
+    def preload(self, rows):
+        # categories and companies of the whole batch, one query each
+        def ids(name):
+            values = {str(row.get(name)) for row in rows if isinstance(row, dict)}
+            return [value for value in values if value.isdigit()]
+
+        return {
+            'category': {str(category.id): category for category in EmployeeCategory.objects.filter(id__in=ids('category'))},
+            'company': {str(company.id): company for company in Company.objects.filter(id__in=ids('company'))},
+        }
+
+    def existing_usernames(self, rows):
+        usernames = {
+            row['user'].get('username') for row in rows
+            if isinstance(row, dict) and isinstance(row.get('user'), dict)
+            and isinstance(row['user'].get('username'), str)
+        }
+        return set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+
+    def validate_row(self, row, company_ids, usernames, existing_usernames):
+        serializer = self.get_serializer(data=row)
+        if not serializer.is_valid():
+            return None, serializer.errors
+
+        data = serializer.validated_data
+        if data['company'].id not in company_ids:
+            return None, {'company': ['Нет доступа к компании {0}'.format(data['company'].id)]}
+        if data['user']['username'] in existing_usernames:
+            return None, {'user': {'username': ['Пользователь с таким именем уже существует']}}
+        if data['user']['username'] in usernames:
+            return None, {'user': {'username': ['Повторяющееся имя пользователя в списке']}}
+        return data, None
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            raise ValidationError({'non_field_errors': ['Ожидается список сотрудников']})
+        if len(rows) > self.max_rows:
+            raise ValidationError({'non_field_errors': ['Не более {0} строк за запрос'.format(self.max_rows)]})
+
+        company_ids = set(get_company_ids(request))
+        self.preloaded = self.preload(rows)
+        existing_usernames = self.existing_usernames(rows)
+        usernames = set()
+        valid_rows = []
+        errors = []
+        for index, row in enumerate(rows):
+            data, row_errors = self.validate_row(row, company_ids, usernames, existing_usernames)
+            if row_errors:
+                errors.append({'index': index, 'errors': row_errors})
+                continue
+            usernames.add(data['user']['username'])
+            valid_rows.append(data)
+
+        employees = bulk_create_employees(valid_rows) if valid_rows else []
+        return Response(
+            {'created': [employee.id for employee in employees], 'errors': errors},
+            status=status.HTTP_201_CREATED if employees else status.HTTP_400_BAD_REQUEST
+        )
+
+
+class EmployeeListView(InstrumentedViewMixin, ConditionalRosterMixin, CompactListMixin, QuerysetOptimizationMixin, generics.ListAPIView):
+    """
+        Возвращает:
+            Список сотрудников компании (постранично: cursor, page_size)
             method: GET
     """
+    roster = 'employees'
     serializer_class = EmployeeSerializer
+    compact_serializer_class = CompactEmployeeSerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated, IsManager]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):  # added string
-        company = Company.objects.filter(managers__user=self.request.user)
-        return EmployeeProfile.objects.filter(category__company__in=company)
+        company_ids = get_company_ids(self.request)
+        return EmployeeProfile.objects.filter(company_id__in=company_ids)
 
 
-class EmployeeDetailView(generics.RetrieveUpdateDestroyAPIView):
+class EmployeeDetailView(InstrumentedViewMixin, ConditionalRosterMixin, QuerysetOptimizationMixin, generics.RetrieveUpdateDestroyAPIView):
     """
             method: GET
             Возвращает:
@@ -117,15 +220,17 @@ class EmployeeDetailView(generics.RetrieveUpdateDestroyAPIView):
             Функция:
                 Удаление данных
     """
+    roster = 'employees'
     serializer_class = EmployeeSerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly]
 
     def get_queryset(self):
-        company = Company.objects.filter(managers__user=self.request.user)
-        return EmployeeProfile.objects.filter(category__company__in=company)
+        company_ids = get_company_ids(self.request)
+        return EmployeeProfile.objects.filter(company_id__in=company_ids)
 
 
-class EmployeeCategoryListCreateView(generics.ListCreateAPIView):
+class EmployeeCategoryListCreateView(InstrumentedViewMixin, ConditionalRosterMixin, QuerysetOptimizationMixin, generics.ListCreateAPIView):
     """
         method: GET
         Возвращает:
@@ -137,61 +242,99 @@ class EmployeeCategoryListCreateView(generics.ListCreateAPIView):
         Возвращает:
             Список категории сотрудников компании с новой категорией        
     """
+    roster = 'categories'
     serializer_class = EmployeeCategorySerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
-        company = Company.objects.filter(managers__user=self.request.user)
-        return EmployeeCategory.objects.filter(company__in=company)
+        company_ids = get_company_ids(self.request)
+        return EmployeeCategory.objects.filter(company_id__in=company_ids)
 
 
-class EmployeeEventsListView(generics.ListAPIView):
+class EmployeeEventsListView(InstrumentedViewMixin, QuerysetOptimizationMixin, generics.ListAPIView):
     """
         method: GET
         Возвращает:
             Список сотрудников и записей прикрепленных к ним
     """
     serializer_class = EmployeeEventsSerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated, IsManager]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
-        company = Company.objects.filter(managers__user=self.request.user)
-        return EmployeeProfile.objects.filter(company__in=company)
+        company_ids = get_company_ids(self.request)
+        return EmployeeProfile.objects.filter(company_id__in=company_ids)
+
+
+def get_period_params(request):
+    """
+        Разбирает параметры периода date_from / date_to (YYYY-MM-DD)
+    """
+    params = getattr(request, 'query_params', request.GET)
+    try:
+        return parse_period(params.get('date_from'), params.get('date_to'))
+    except PeriodError as error:
+        raise ValidationError({error.bound: error.message})
 
 
-class EmployeeSalaryView(generics.GenericAPIView):
-    permission_class = [IsAuthenticated, IsManager]
+class EmployeeSalaryView(InstrumentedViewMixin, generics.GenericAPIView):
+    """
+        method: GET
+        Параметры:
+            date_from, date_to - период расчета (по умолчанию текущий месяц)
+        Возвращает:
+            Зарплату сотрудника за период
+    """
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
 
     def get(self, request, pk):
-        
-        employee = get_object_or_404(EmployeeProfile, pk=pk)
-        company = employee.company
+        employees = EmployeeProfile.objects.filter(company_id__in=get_company_ids(request))
+        employee = get_object_or_404(employees.select_related('salary'), pk=pk)
+        date_from, date_to = get_period_params(request)
+        return Response(employee_payroll(employee, date_from, date_to))
 
-        try:
-            percentage = employee.salary.percentage_of_income
-            percentage = 0 if percentage is None else percentage
-        except:
-            percentage = 0
-        
-        events = Event.objects.filter(company=company, employee=employee)
 
-        employee_income = 0
+class CompanyPayrollView(InstrumentedViewMixin, generics.GenericAPIView):
+    """
+        method: GET
+        Параметры:
+            date_from, date_to - период расчета (по умолчанию текущий месяц)
+        Возвращает:
+            Зарплаты всех сотрудников компаний менеджера
+    """
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request):
+        company_ids = get_company_ids(request)
+        date_from, date_to = get_period_params(request)
+        return Response(company_payroll(company_ids, date_from, date_to))
 
-        for event in events:
-            event_income = event.service.price
-            employee_income += (event_income / 100) * percentage
 
-        try:
-            employee_income += employee.salary.salary
-        except:
-            pass
+class CompanyPayrollReportView(InstrumentedViewMixin, generics.GenericAPIView):
+    """
+        method: GET
+        Параметры:
+            date_from, date_to - период расчета (по умолчанию текущий месяц)
+        Возвращает:
+            Потоковую выгрузку зарплат всех сотрудников компаний менеджера в CSV
+    """
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
 
-        return Response({
-            "employee_salary": employee_income
-        })
+    def get(self, request):
+        date_from, date_to = get_period_params(request)
+        names, rows = payroll_report(get_company_ids(request), date_from, date_to)
+        response = StreamingHttpResponse(render_csv(names, rows), content_type=EXPORT_FORMATS['csv'])
+        response['Content-Disposition'] = 'attachment; filename="payroll.csv"'
+        return response
 
 
-class CustomerAddView(generics.CreateAPIView):
+class CustomerAddView(InstrumentedViewMixin, generics.CreateAPIView):
     """
         method: POST
         Функция:
@@ -204,12 +347,211 @@ class CustomerAddView(generics.CreateAPIView):
     queryset = CustomerProfile.objects.all()
 
 
-class CustomersListView(generics.ListAPIView):
+class CustomerImportView(InstrumentedViewMixin, generics.GenericAPIView):
+    """
+        method: POST (multipart)
+        Параметры:
+            file - файл csv, ndjson или json
+            company - id компании
+            file_format - формат файла (по умолчанию по расширению)
+            on_conflict - skip (по умолчанию) или update для найденных по телефону/email клиентов
+            unusable_passwords - true (по умолчанию): создавать клиентов без пароля
+        Возвращает:
+            Количество созданных, обновленных и пропущенных клиентов и ошибки по строкам
+    """
+    permission_classes = [IsAuthenticated, IsManager]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['Файл не передан']})
+
+        file_format = request.data.get('file_format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in CUSTOMER_IMPORT_FORMATS:
+            raise ValidationError({'file_format': ['Допустимые значения: %s' % ', '.join(CUSTOMER_IMPORT_FORMATS)]})
+
+        try:
+            company_id = int(request.data.get('company'))
+        except (TypeError, ValueError):
+            raise ValidationError({'company': ['Укажите id компании']})
+        if company_id not in get_company_ids(request):
+            raise ValidationError({'company': ['Нет доступа к компании {0}'.format(company_id)]})
+
+        on_conflict = request.data.get('on_conflict', 'skip')
+        if on_conflict not in ('skip', 'update'):
+            raise ValidationError({'on_conflict': ['Допустимые значения: skip, update']})
+
+        creator_id = get_object_or_404(ManagerProfile.objects.values_list('id', flat=True), user_id=request.user.id)
+        try:
+            stats = import_customers(
+                read_customer_rows(upload.file, file_format),
+                company_id=company_id,
+                creator_id=creator_id,
+                update_existing=on_conflict == 'update',
+                unusable_passwords=request.data.get('unusable_passwords', 'true').lower() != 'false',
+            )
+        except (ValueError, UnicodeDecodeError) as error:
+            raise ValidationError({'file': ['Не удалось прочитать файл: {0}'.format(error)]})
+        return Response(stats)
+
+
+class CustomersListView(InstrumentedViewMixin, ConditionalRosterMixin, CompactListMixin, QuerysetOptimizationMixin, generics.ListAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated, IsManager]
+    pagination_class = IdCursorPagination
+    roster = 'customers'
     serializer_class = CustomerSerializer
+    compact_serializer_class = CompactCustomerSerializer
 
     def get_queryset(self):
-        company = Company.objects.filter(managers__user=self.request.user)
-        return CustomerProfile.objects.filter(creator__company__in=company)
+        company_ids = get_company_ids(self.request)
+        return CustomerProfile.objects.filter(company_id__in=company_ids)
+
 
+class RosterExportView(InstrumentedViewMixin, generics.GenericAPIView):
+    """
+        method: GET
+        Параметры:
+            export_format - ndjson (по умолчанию) или csv
+        Возвращает:
+            Потоковую выгрузку сотрудников или клиентов компаний менеджера
+    """
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+    roster = None
+
+    def get(self, request):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': 'Допустимые значения: %s' % ', '.join(EXPORT_FORMATS)})
+
+        names, rows = export_rows(self.roster, get_company_ids(request))
+        response = StreamingHttpResponse(
+            render(export_format, names, rows),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (self.roster, export_format)
+        return response
+
+
+class OnlineUsersView(InstrumentedViewMixin, generics.GenericAPIView):
+    """
+        method: GET
+        Параметры:
+            company - id компании
+        Возвращает:
+            id пользователей компании, которые сейчас в сети
+    """
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request):
+        try:
+            company_id = int(request.query_params.get('company'))
+        except (TypeError, ValueError):
+            raise ValidationError({'company': ['Укажите id компании']})
+        if company_id not in get_company_ids(request):
+            raise ValidationError({'company': ['Нет доступа к компании {0}'.format(company_id)]})
+        return Response({'company': company_id, 'online': online_in_company(company_id)})
+
+
+class ProfileSearchView(InstrumentedViewMixin, QuerysetOptimizationMixin, generics.ListAPIView):
+    """
+        method: GET
+        Параметры:
+            q - часть ФИО, телефона или адреса
+            limit - количество результатов (по умолчанию 20, не более 100)
+        Возвращает:
+            Найденных сотрудников или клиентов компаний менеджера
+    """
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+    pagination_class = None
+    model = None
+    default_limit = 20
+    max_limit = 100
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '')
+        return search_profiles(self.model, get_company_ids(self.request), query).order_by('id')
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': ['Ожидается число']})
+        return max(1, min(limit, self.max_limit))
+
+    def filter_queryset(self, queryset):
+        return super().filter_queryset(queryset)[:self.get_limit()]
+
+
+def get_int_param(request, name, required=False):
+    """
+        Разбирает целочисленный параметр запроса
+    """
+    value = request.query_params.get(name)
+    if value is None:
+        if required:
+            raise ValidationError({name: ['Обязательный параметр']})
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: ['Ожидается число']})
+
+
+class EmployeeAvailabilityView(InstrumentedViewMixin, ConditionalRosterMixin, generics.GenericAPIView):
+    """
+        method: GET
+        Параметры:
+            day - день недели (1 - ПН ... 7 - ВС)
+            category - id категории сотрудников (необязательно)
+        Возвращает:
+            Сотрудников компаний менеджера, работающих в этот день, и их рабочие часы
+    """
+    roster = 'employees'
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request):
+        day = get_int_param(request, 'day', required=True)
+        if day not in dict(WorkDay.DAYS_OF_THE_WEEK):
+            raise ValidationError({'day': ['Ожидается число от 1 до 7']})
+        employees = list(working_on(get_company_ids(request), day, get_int_param(request, 'category')))
+        return Response({
+            'day': day,
+            'hours': sum(row['working_hours'] for row in employees),
+            'employees': employees,
+        })
+
+
+class EmployeeCapacityView(InstrumentedViewMixin, ConditionalRosterMixin, generics.GenericAPIView):
+    """
+        method: GET
+        Параметры:
+            category - id категории сотрудников (необязательно)
+        Возвращает:
+            Запланированные часы и число сотрудников по категориям и дням недели,
+            итог часов в неделю по категориям
+    """
+    roster = 'employees'
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request):
+        days = weekly_capacity(get_company_ids(request), get_int_param(request, 'category'))
+        return Response({'categories': category_hours(days), 'days': days})
+
+
+class MetricsView(generics.GenericAPIView):
+    """
+        method: GET
+        Возвращает:
+            Метрики запросов к API профилей в текстовом формате Prometheus
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
 
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')